@@ -4,16 +4,19 @@ from importlib.resources import files
 
 import soundfile as sf
 import tqdm
-from cached_path import cached_path
 
 from f5_tts.infer.utils_infer import (
     hop_length,
+    infer_batch_requests,
     infer_process,
-    load_model,
-    load_vocoder,
+    infer_process_stream,
+    model_registry,
     preprocess_ref_audio_text,
     remove_silence_for_generated_wav,
     save_spectrogram,
+    set_model_budget,
+    set_output_cache,
+    set_voice_cache,
     transcribe,
     target_sample_rate,
 )
@@ -33,6 +36,9 @@ class F5TTS:
         local_path=None,
         device=None,
         hf_cache_dir=None,
+        voice_cache_dir=None,
+        max_model_bytes=None,
+        output_cache_dir=None,
     ):
         # Initialize parameters
         self.final_wave = None
@@ -49,6 +55,19 @@ class F5TTS:
 
             self.device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
 
+        # Processed reference voices (clipped audio, transcript, mel) kept on disk, reused across runs
+        if voice_cache_dir is not None:
+            set_voice_cache(voice_cache_dir)
+
+        # Generated audio kept on disk per sentence, repeated requests with an explicit seed are read back
+        if output_cache_dir is not None:
+            set_output_cache(output_cache_dir)
+
+        # Models & vocoders are shared by all instances in the process, over max_model_bytes the least recently used
+        # models are unloaded
+        if max_model_bytes is not None:
+            set_model_budget(max_model_bytes)
+
         # Load models
         self.load_vocoder_model(vocoder_name, local_path=local_path, hf_cache_dir=hf_cache_dir)
         self.load_ema_model(
@@ -56,9 +75,13 @@ class F5TTS:
         )
 
     def load_vocoder_model(self, vocoder_name, local_path=None, hf_cache_dir=None):
-        self.vocoder = load_vocoder(vocoder_name, local_path is not None, local_path, self.device, hf_cache_dir)
+        self.vocoder = model_registry.get_vocoder(
+            vocoder_name, local_path is not None, local_path, self.device, hf_cache_dir
+        )
 
     def load_ema_model(self, model_type, ckpt_file, mel_spec_type, vocab_file, ode_method, use_ema, hf_cache_dir=None):
+        from cached_path import cached_path
+
         if model_type == "F5-TTS":
             if not ckpt_file:
                 if mel_spec_type == "vocos":
@@ -81,7 +104,7 @@ class F5TTS:
         else:
             raise ValueError(f"Unknown model type: {model_type}")
 
-        self.ema_model = load_model(
+        self.ema_model = model_registry.get_model(
             model_cls, model_cfg, ckpt_file, mel_spec_type, vocab_file, ode_method, use_ema, self.device
         )
 
@@ -106,16 +129,23 @@ class F5TTS:
         progress=tqdm,
         target_rms=0.1,
         cross_fade_duration=0.15,
+        cross_fade_curve="linear",
         sway_sampling_coef=-1,
         cfg_strength=2,
-        nfe_step=32,
+        cfg_schedule=None,
+        block_cache=None,
+        nfe_step=None,
         speed=1.0,
         fix_duration=None,
         remove_silence=False,
         file_wave=None,
         file_spect=None,
         seed=-1,
+        batch_chunks=False,
+        vocoder_max_frames=None,
+        vocoder_num_workers=1,
     ):
+        explicit_seed = seed != -1  # only then is the output reproducible, and cached
         if seed == -1:
             seed = random.randint(0, sys.maxsize)
         seed_everything(seed)
@@ -134,12 +164,19 @@ class F5TTS:
             progress=progress,
             target_rms=target_rms,
             cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
             nfe_step=nfe_step,
             cfg_strength=cfg_strength,
+            cfg_schedule=cfg_schedule,
+            block_cache=block_cache,
             sway_sampling_coef=sway_sampling_coef,
             speed=speed,
             fix_duration=fix_duration,
             device=self.device,
+            batch_chunks=batch_chunks,
+            seed=seed if explicit_seed else None,
+            vocoder_max_frames=vocoder_max_frames,
+            vocoder_num_workers=vocoder_num_workers,
         )
 
         if file_wave is not None:
@@ -150,6 +187,117 @@ class F5TTS:
 
         return wav, sr, spect
 
+    def infer_stream(
+        self,
+        ref_file,
+        ref_text,
+        gen_text,
+        show_info=print,
+        progress=tqdm,
+        target_rms=0.1,
+        cross_fade_duration=0.15,
+        cross_fade_curve="linear",
+        sway_sampling_coef=-1,
+        cfg_strength=2,
+        cfg_schedule=None,
+        block_cache=None,
+        nfe_step=None,
+        speed=1.0,
+        fix_duration=None,
+        first_chunk_chars=40,
+        first_nfe_step=None,
+        seed=-1,
+        vocoder_max_frames=None,
+        vocoder_num_workers=1,
+    ):
+        # yields float32 audio at self.target_sample_rate chunk by chunk, playback can start after the first chunk
+        # which is kept short (first_chunk_chars, None for chunks of equal budget), optionally with fewer steps
+        if seed == -1:
+            seed = random.randint(0, sys.maxsize)
+        seed_everything(seed)
+        self.seed = seed
+
+        ref_file, ref_text = preprocess_ref_audio_text(ref_file, ref_text, device=self.device)
+
+        yield from infer_process_stream(
+            ref_file,
+            ref_text,
+            gen_text,
+            self.ema_model,
+            self.vocoder,
+            self.mel_spec_type,
+            show_info=show_info,
+            progress=progress,
+            target_rms=target_rms,
+            cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            cfg_schedule=cfg_schedule,
+            block_cache=block_cache,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            device=self.device,
+            first_chunk_chars=first_chunk_chars,
+            first_nfe_step=first_nfe_step,
+            vocoder_max_frames=vocoder_max_frames,
+            vocoder_num_workers=vocoder_num_workers,
+        )
+
+    def infer_batch(
+        self,
+        requests,  # list of (ref_file, ref_text, gen_text)
+        show_info=print,
+        progress=tqdm,
+        target_rms=0.1,
+        cross_fade_duration=0.15,
+        cross_fade_curve="linear",
+        sway_sampling_coef=-1,
+        cfg_strength=2,
+        cfg_schedule=None,
+        block_cache=None,
+        nfe_step=None,
+        speed=1.0,
+        fix_duration=None,
+        max_batch_frames=16384,
+        seed=-1,
+        vocoder_max_frames=None,
+        vocoder_num_workers=1,
+    ):
+        # several requests of different lengths in shared sample calls, returns (wav, sr, spect) per request
+        if seed == -1:
+            seed = random.randint(0, sys.maxsize)
+        seed_everything(seed)
+        self.seed = seed
+
+        requests = [
+            (*preprocess_ref_audio_text(ref_file, ref_text, show_info=show_info, device=self.device), gen_text)
+            for ref_file, ref_text, gen_text in requests
+        ]
+
+        return infer_batch_requests(
+            requests,
+            self.ema_model,
+            self.vocoder,
+            self.mel_spec_type,
+            progress=progress,
+            target_rms=target_rms,
+            cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            cfg_schedule=cfg_schedule,
+            block_cache=block_cache,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            max_batch_frames=max_batch_frames,
+            vocoder_max_frames=vocoder_max_frames,
+            vocoder_num_workers=vocoder_num_workers,
+            device=self.device,
+        )
+
 
 if __name__ == "__main__":
     f5tts = F5TTS()
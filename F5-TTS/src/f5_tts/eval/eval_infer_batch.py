@@ -51,8 +51,10 @@ def main():
     parser.add_argument("-m", "--mel_spec_type", default="vocos", type=str, choices=["bigvgan", "vocos"])
 
     parser.add_argument("-nfe", "--nfestep", default=32, type=int)
-    parser.add_argument("-o", "--odemethod", default="euler")
+    parser.add_argument("-o", "--odemethod", default="euler", help="euler | midpoint | heun | ab2 | ab3")
     parser.add_argument("-ss", "--swaysampling", default=-1, type=float)
+    parser.add_argument("-ci", "--cacheinterval", default=1, type=int, help="reuse middle DiT blocks, 1 to disable")
+    parser.add_argument("-ct", "--cachethreshold", default=None, type=float, help="refresh block cache on drift")
 
     parser.add_argument("-t", "--testset", required=True)
 
@@ -68,6 +70,9 @@ def main():
     nfe_step = args.nfestep
     ode_method = args.odemethod
     sway_sampling_coef = args.swaysampling
+    cache_interval = args.cacheinterval
+    cache_threshold = args.cachethreshold
+    block_cache = dict(interval=cache_interval, threshold=cache_threshold) if cache_interval > 1 else None
 
     testset = args.testset
 
@@ -105,6 +110,8 @@ def main():
         f"seed{seed}_{ode_method}_nfe{nfe_step}_{mel_spec_type}"
         f"{f'_ss{sway_sampling_coef}' if sway_sampling_coef else ''}"
         f"_cfg{cfg_strength}_speed{speed}"
+        f"{f'_cache{cache_interval}' if block_cache else ''}"
+        f"{f'-th{cache_threshold}' if block_cache and cache_threshold is not None else ''}"
         f"{'_gt-dur' if use_truth_duration else ''}"
         f"{'_no-ref-audio' if no_ref_audio else ''}"
     )
@@ -183,6 +190,7 @@ def main():
                     sway_sampling_coef=sway_sampling_coef,
                     no_ref_audio=no_ref_audio,
                     seed=seed,
+                    block_cache=block_cache,
                 )
                 # Final result
                 for i, gen in enumerate(generated):
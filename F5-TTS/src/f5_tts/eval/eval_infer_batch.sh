@@ -10,4 +10,15 @@ accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -t "s
 accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -t "seedtts_test_en" -o "midpoint" -ss 0
 accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "E2TTS_Base" -t "ls_pc_test_clean" -o "midpoint" -ss 0
 
+# e.g. F5-TTS, multistep ab3 solver at 8/12/16 NFE vs. euler at 32 NFE, compare with eval_solver_comparison.py
+accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "F5TTS_Base" -t "seedtts_test_zh" -nfe 32 -o "euler"
+for nfe in 8 12 16; do
+    accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "F5TTS_Base" -t "seedtts_test_zh" -nfe $nfe -o "ab3"
+done
+
+# e.g. F5-TTS, 32 NFE with middle DiT blocks reused across every 2/3 steps, compare with eval_solver_comparison.py
+for ci in 2 3; do
+    accelerate launch src/f5_tts/eval/eval_infer_batch.py -s 0 -n "F5TTS_Base" -t "seedtts_test_zh" -nfe 32 -ci $ci
+done
+
 # etc.
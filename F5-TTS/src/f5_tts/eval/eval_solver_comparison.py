@@ -0,0 +1,97 @@
+# Compare ode solvers at different NFE on Seed-TTS testset, e.g. multistep ab3 at 8/12/16 NFE vs. euler at 32 NFE
+# also sampling with DiT block cache (-ci of eval_infer_batch.py), e.g. euler at 32 NFE reusing blocks over 2/3 steps
+# First generate samples for each setting with eval_infer_batch.sh (see the solver & block cache sweeps there)
+
+import sys
+import os
+
+sys.path.append(os.getcwd())
+
+import multiprocessing as mp
+from importlib.resources import files
+
+import numpy as np
+
+from f5_tts.eval.utils_eval import (
+    get_seed_tts_test,
+    run_asr_wer,
+    run_sim,
+)
+
+rel_path = str(files("f5_tts").joinpath("../../"))
+
+
+lang = "zh"  # zh | en
+exp_name = "F5TTS_Base"
+ckpt_step = 1200000
+seed = 0
+mel_spec_type = "vocos"
+sway_sampling_coef = -1.0
+cfg_strength = 2.0
+speed = 1.0
+settings = [  # (ode_method, nfe_step, cache_interval), first one is the reference, cache_interval 1 is no cache
+    ("euler", 32, 1),
+    ("ab3", 16, 1),
+    ("ab3", 12, 1),
+    ("ab3", 8, 1),
+    ("euler", 16, 1),
+    ("euler", 32, 2),
+    ("euler", 32, 3),
+]
+
+metalst = rel_path + f"/data/seedtts_testset/{lang}/meta.lst"  # seed-tts testset
+results_dir = rel_path + f"/results/{exp_name}_{ckpt_step}/seedtts_test_{lang}"
+
+gpus = [0, 1, 2, 3, 4, 5, 6, 7]
+
+local = False
+if local:  # use local custom checkpoint dir
+    if lang == "zh":
+        asr_ckpt_dir = "../checkpoints/funasr"  # paraformer-zh dir under funasr
+    elif lang == "en":
+        asr_ckpt_dir = "../checkpoints/Systran/faster-whisper-large-v3"
+else:
+    asr_ckpt_dir = ""  # auto download to cache dir
+
+wavlm_ckpt_dir = "../checkpoints/UniSpeech/wavlm_large_finetune.pth"
+
+
+def get_gen_wav_dir(ode_method, nfe_step, cache_interval):
+    # same naming as output_dir in eval_infer_batch.py
+    return (
+        f"{results_dir}/"
+        f"seed{seed}_{ode_method}_nfe{nfe_step}_{mel_spec_type}"
+        f"{f'_ss{sway_sampling_coef}' if sway_sampling_coef else ''}"
+        f"_cfg{cfg_strength}_speed{speed}"
+        f"{f'_cache{cache_interval}' if cache_interval > 1 else ''}"
+    )
+
+
+def main():
+    rows = []
+    for ode_method, nfe_step, cache_interval in settings:
+        gen_wav_dir = get_gen_wav_dir(ode_method, nfe_step, cache_interval)
+        if not os.path.exists(gen_wav_dir):
+            print(f"Skip {ode_method} nfe{nfe_step} cache{cache_interval}, not generated yet: {gen_wav_dir}")
+            continue
+        test_set = get_seed_tts_test(metalst, gen_wav_dir, gpus)
+
+        with mp.Pool(processes=len(gpus)) as pool:
+            args = [(rank, lang, sub_test_set, asr_ckpt_dir) for (rank, sub_test_set) in test_set]
+            wers = [wer for wers_ in pool.map(run_asr_wer, args) for wer in wers_]
+
+        with mp.Pool(processes=len(gpus)) as pool:
+            args = [(rank, sub_test_set, wavlm_ckpt_dir) for (rank, sub_test_set) in test_set]
+            sim_list = [sim for sim_ in pool.map(run_sim, args) for sim in sim_]
+
+        wer = round(np.mean(wers) * 100, 3)
+        sim = round(sum(sim_list) / len(sim_list), 3)
+        rows.append((ode_method, nfe_step, cache_interval, wer, sim))
+
+    print(f"\n{'method':<10}{'nfe':>6}{'cache':>8}{'WER (%)':>12}{'SIM':>10}")
+    for ode_method, nfe_step, cache_interval, wer, sim in rows:
+        print(f"{ode_method:<10}{nfe_step:>6}{cache_interval:>8}{wer:>12}{sim:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,20 +5,34 @@ import re
 from importlib.resources import files
 from pathlib import Path
 
-import numpy as np
 import soundfile as sf
 import tomli
 from cached_path import cached_path
 
 from f5_tts.infer.utils_infer import (
     infer_process,
-    load_model,
-    load_vocoder,
+    infer_process_stream,
+    model_registry,
     preprocess_ref_audio_text,
     remove_silence_for_generated_wav,
+    target_sample_rate,
 )
 from f5_tts.model import DiT, UNetT
 
+
+def cfg_schedule_type(value):
+    # 'linear' | 'cosine' | 't_lo,t_hi', checked here so a bad value fails before the models are loaded
+    if value in ("linear", "cosine"):
+        return value
+    try:
+        t_lo, t_hi = (float(t) for t in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected 'linear', 'cosine' or 't_lo,t_hi', got '{value}'")
+    if not 0 <= t_lo <= t_hi <= 1:
+        raise argparse.ArgumentTypeError(f"expected 0 <= t_lo <= t_hi <= 1, got '{value}'")
+    return (t_lo, t_hi)
+
+
 parser = argparse.ArgumentParser(
     prog="python3 infer-cli.py",
     description="Commandline interface for E2/F5 TTS with Advanced Batch Processing.",
@@ -90,8 +104,31 @@ parser.add_argument(
 parser.add_argument(
     "--nfe",
     type=int,
-    default=32,
-    help="Set the number of denoising steps (default: 32)",
+    default=None,
+    help="Set the number of denoising steps (default: 32, or the native steps of a few-step distilled model)",
+)
+parser.add_argument(
+    "--cfg_schedule",
+    type=cfg_schedule_type,
+    default=None,
+    help="Classifier-free guidance schedule, 't_lo,t_hi' to guide only within that time interval, skipping the unconditional pass elsewhere (faster), or 'linear' | 'cosine' to decay the guidance strength on every step (same speed) (default: constant)",
+)
+parser.add_argument(
+    "--batch_chunks",
+    action="store_true",
+    help="Generate all text chunks of a voice segment in batched sample and vocoder calls instead of one by one",
+)
+parser.add_argument(
+    "--vocoder_max_frames",
+    type=int,
+    default=None,
+    help="Mel frames per vocoder call, longer mels are vocoded in overlapping windows to bound memory (default: no limit)",
+)
+parser.add_argument(
+    "--vocoder_workers",
+    type=int,
+    default=1,
+    help="Vocoder calls at a time on those windows, each on its own thread (default: 1)",
 )
 args = parser.parse_args()
 
@@ -123,6 +160,10 @@ vocab_file = args.vocab_file if args.vocab_file else ""
 remove_silence = args.remove_silence if args.remove_silence else config["remove_silence"]
 speed = args.speed
 nfe_step = args.nfe
+cfg_schedule = args.cfg_schedule
+batch_chunks = args.batch_chunks
+vocoder_max_frames = args.vocoder_max_frames
+vocoder_num_workers = args.vocoder_workers
 indic = False
 
 wave_path = Path(output_dir) / output_file
@@ -135,7 +176,9 @@ if vocoder_name == "vocos":
 elif vocoder_name == "bigvgan":
     vocoder_local_path = "../checkpoints/bigvgan_v2_24khz_100band_256x"
 
-vocoder = load_vocoder(vocoder_name=mel_spec_type, is_local=args.load_vocoder_from_local, local_path=vocoder_local_path)
+vocoder = model_registry.get_vocoder(
+    vocoder_name=mel_spec_type, is_local=args.load_vocoder_from_local, local_path=vocoder_local_path
+)
 
 
 # load models
@@ -181,7 +224,9 @@ elif model == "E2-TTS":
 
 
 print(f"Using {model}...")
-ema_model = load_model(model_cls, model_cfg, ckpt_file, mel_spec_type=mel_spec_type, vocab_file=vocab_file)
+ema_model = model_registry.get_model(
+    model_cls, model_cfg, ckpt_file, mel_spec_type=mel_spec_type, vocab_file=vocab_file
+)
 
 
 def main_process(ref_audio, ref_text, text_gen, model_obj, mel_spec_type, remove_silence, speed):
@@ -199,44 +244,77 @@ def main_process(ref_audio, ref_text, text_gen, model_obj, mel_spec_type, remove
         print("Ref_audio:", voices[voice]["ref_audio"])
         print("Ref_text:", voices[voice]["ref_text"])
 
-    generated_audio_segments = []
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
     reg1 = r"(?=\[\w+\])"
     chunks = re.split(reg1, text_gen)
     reg2 = r"\[(\w+)\]"
-    for text in chunks:
-        if not text.strip():
-            continue
-        match = re.match(reg2, text)
-        if match:
-            voice = match[1]
-        else:
-            print("No voice tag found, using main.")
-            voice = "main"
-        if voice not in voices:
-            print(f"Voice {voice} not found, using main.")
-            voice = "main"
-        text = re.sub(reg2, "", text)
-        gen_text = text.strip()
-        ref_audio = voices[voice]["ref_audio"]
-        ref_text = voices[voice]["ref_text"]
-        print(f"Voice: {voice}")
-        audio, final_sample_rate, spectragram = infer_process(
-            ref_audio, ref_text, gen_text, model_obj, vocoder, mel_spec_type=mel_spec_type, speed=speed, nfe_step=nfe_step, indic=indic
-        )
-        generated_audio_segments.append(audio)
 
-    if generated_audio_segments:
-        final_wave = np.concatenate(generated_audio_segments)
+    # written as audio comes in, a failed run leaves no truncated file behind
+    try:
+        with sf.SoundFile(wave_path, "w", samplerate=target_sample_rate, channels=1) as f:
+            for text in chunks:
+                if not text.strip():
+                    continue
+                match = re.match(reg2, text)
+                if match:
+                    voice = match[1]
+                else:
+                    print("No voice tag found, using main.")
+                    voice = "main"
+                if voice not in voices:
+                    print(f"Voice {voice} not found, using main.")
+                    voice = "main"
+                text = re.sub(reg2, "", text)
+                gen_text = text.strip()
+                ref_audio = voices[voice]["ref_audio"]
+                ref_text = voices[voice]["ref_text"]
+                print(f"Voice: {voice}")
+                if batch_chunks:
+                    audio, final_sample_rate, spectragram = infer_process(
+                        ref_audio,
+                        ref_text,
+                        gen_text,
+                        model_obj,
+                        vocoder,
+                        mel_spec_type=mel_spec_type,
+                        speed=speed,
+                        nfe_step=nfe_step,
+                        cfg_schedule=cfg_schedule,
+                        indic=indic,
+                        batch_chunks=batch_chunks,
+                        vocoder_max_frames=vocoder_max_frames,
+                        vocoder_num_workers=vocoder_num_workers,
+                    )
+                    f.write(audio)
+                    continue
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+                # stream chunk by chunk, each written once vocoded and cross-faded
+                for audio in infer_process_stream(
+                    ref_audio,
+                    ref_text,
+                    gen_text,
+                    model_obj,
+                    vocoder,
+                    mel_spec_type=mel_spec_type,
+                    speed=speed,
+                    nfe_step=nfe_step,
+                    cfg_schedule=cfg_schedule,
+                    indic=indic,
+                    vocoder_max_frames=vocoder_max_frames,
+                    vocoder_num_workers=vocoder_num_workers,
+                ):
+                    f.write(audio)
+    except BaseException:
+        if os.path.exists(wave_path):
+            os.remove(wave_path)
+        raise
 
-        with open(wave_path, "wb") as f:
-            sf.write(f.name, final_wave, final_sample_rate)
-            # Remove silence
-            if remove_silence:
-                remove_silence_for_generated_wav(f.name)
-            print(f.name)
+    # Remove silence
+    if remove_silence:
+        remove_silence_for_generated_wav(wave_path)
+    print(wave_path)
 
 
 def main():
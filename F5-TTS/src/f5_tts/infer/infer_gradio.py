@@ -31,12 +31,14 @@ def gpu_decorator(func):
 
 from f5_tts.model import DiT, UNetT
 from f5_tts.infer.utils_infer import (
-    load_vocoder,
-    load_model,
+    model_registry,
     preprocess_ref_audio_text,
     infer_process,
+    infer_process_stream,
     remove_silence_for_generated_wav,
     save_spectrogram,
+    set_model_budget,
+    target_sample_rate,
 )
 
 
@@ -44,26 +46,26 @@ DEFAULT_TTS_MODEL = "F5-TTS"
 tts_model_choice = DEFAULT_TTS_MODEL
 
 
-# load models
+# load models, kept resident in model_registry, so switching between them does not reload
 
-vocoder = load_vocoder()
+vocoder = model_registry.get_vocoder()
 
 
-def load_f5tts_small(ckpt_path=str(cached_path("hf://SPRINGLab/F5-Hindi-24KHz/model_2500000.safetensors")), vocab_path=str(cached_path("hf://SPRINGLab/F5-Hindi-24KHz/vocab.txt"))):
+def load_f5tts_small(ckpt_path=str(cached_path("hf://SPRINGLab/F5-Hindi-24KHz/model_2500000.safetensors")), vocab_path=str(cached_path("hf://SPRINGLab/F5-Hindi-24KHz/vocab.txt")), show_info=None):
     F5TTS_small_model_cfg = dict(dim=768, depth=18, heads=12, ff_mult=2, text_dim=512, conv_layers=4)
-    return load_model(DiT, F5TTS_small_model_cfg, ckpt_path, vocab_file=vocab_path)
+    return model_registry.get_model(DiT, F5TTS_small_model_cfg, ckpt_path, vocab_file=vocab_path, show_info=show_info)
 
-def load_f5tts(ckpt_path=str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors"))):
+def load_f5tts(ckpt_path=str(cached_path("hf://SWivid/F5-TTS/F5TTS_Base/model_1200000.safetensors")), show_info=None):
     F5TTS_model_cfg = dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)
-    return load_model(DiT, F5TTS_model_cfg, ckpt_path)
+    return model_registry.get_model(DiT, F5TTS_model_cfg, ckpt_path, show_info=show_info)
 
 
-def load_e2tts(ckpt_path=str(cached_path("hf://SWivid/E2-TTS/E2TTS_Base/model_1200000.safetensors"))):
+def load_e2tts(ckpt_path=str(cached_path("hf://SWivid/E2-TTS/E2TTS_Base/model_1200000.safetensors")), show_info=None):
     E2TTS_model_cfg = dict(dim=1024, depth=24, heads=16, ff_mult=4)
-    return load_model(UNetT, E2TTS_model_cfg, ckpt_path)
+    return model_registry.get_model(UNetT, E2TTS_model_cfg, ckpt_path, show_info=show_info)
 
 
-def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
+def load_custom(ckpt_path: str, vocab_path="", model_cfg=None, show_info=None):
     ckpt_path, vocab_path = ckpt_path.strip(), vocab_path.strip()
     if ckpt_path.startswith("hf://"):
         ckpt_path = str(cached_path(ckpt_path))
@@ -71,14 +73,14 @@ def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
         vocab_path = str(cached_path(vocab_path))
     if model_cfg is None:
         model_cfg = dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)
-    return load_model(DiT, model_cfg, ckpt_path, vocab_file=vocab_path)
+    return model_registry.get_model(DiT, model_cfg, ckpt_path, vocab_file=vocab_path, show_info=show_info)
 
 
 
-F5TTS_small_ema_model = load_f5tts_small()
-F5TTS_ema_model = load_f5tts()
-E2TTS_ema_model = load_e2tts() if USING_SPACES else None
-custom_ema_model, pre_custom_path = None, ""
+load_f5tts_small()
+load_f5tts()
+if USING_SPACES:
+    load_e2tts()
 
 chat_model_state = None
 chat_tokenizer_state = None
@@ -107,33 +109,38 @@ def generate_response(messages, model, tokenizer):
     return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
 
 
-@gpu_decorator
-def infer(
-    ref_audio_orig, ref_text, gen_text, model, remove_silence, nfe_step=32, cross_fade_duration=0.15, speed=1, show_info=gr.Info
-):
-    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
-
+def select_model(model, show_info=gr.Info):
     indic = False
 
     if model == "F5-TTS":
-        ema_model = F5TTS_ema_model
+        ema_model = load_f5tts(show_info=show_info)
     elif model == "F5-TTS-small":
         indic = True
-        ema_model = F5TTS_small_ema_model
+        ema_model = load_f5tts_small(show_info=show_info)
     elif model == "E2-TTS":
-        global E2TTS_ema_model
-        if E2TTS_ema_model is None:
-            show_info("Loading E2-TTS model...")
-            E2TTS_ema_model = load_e2tts()
-        ema_model = E2TTS_ema_model
+        ema_model = load_e2tts(show_info=show_info)
     elif isinstance(model, list) and model[0] == "Custom":
         assert not USING_SPACES, "Only official checkpoints allowed in Spaces."
-        global custom_ema_model, pre_custom_path
-        if pre_custom_path != model[1]:
-            show_info("Loading Custom TTS model...")
-            custom_ema_model = load_custom(model[1], vocab_path=model[2])
-            pre_custom_path = model[1]
-        ema_model = custom_ema_model
+        ema_model = load_custom(model[1], vocab_path=model[2], show_info=show_info)
+
+    return ema_model, indic
+
+
+@gpu_decorator
+def infer(
+    ref_audio_orig,
+    ref_text,
+    gen_text,
+    model,
+    remove_silence,
+    nfe_step=None,  # None or 0 for the model's default, 32 or the native steps of a distilled model
+    cross_fade_duration=0.15,
+    speed=1,
+    show_info=gr.Info,
+    cfg_schedule=None,
+):
+    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+    ema_model, indic = select_model(model, show_info=show_info)
 
     final_wave, final_sample_rate, combined_spectrogram = infer_process(
         ref_audio,
@@ -143,7 +150,8 @@ def infer(
         vocoder,
         cross_fade_duration=cross_fade_duration,
         speed=speed,
-        nfe_step=nfe_step,
+        nfe_step=nfe_step or None,
+        cfg_schedule=cfg_schedule,
         indic=indic,
         show_info=show_info,
         progress=gr.Progress(),
@@ -165,6 +173,38 @@ def infer(
     return (final_sample_rate, final_wave), spectrogram_path, ref_text
 
 
+@gpu_decorator
+def infer_stream(
+    ref_audio_orig,
+    ref_text,
+    gen_text,
+    model,
+    nfe_step=None,  # None or 0 for the model's default, 32 or the native steps of a distilled model
+    cross_fade_duration=0.15,
+    speed=1,
+    show_info=gr.Info,
+    cfg_schedule=None,
+):
+    # yields (sample_rate, audio) pieces for a streaming gr.Audio, starting once the first chunk is vocoded
+    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+    ema_model, indic = select_model(model, show_info=show_info)
+
+    for audio in infer_process_stream(
+        ref_audio,
+        ref_text,
+        gen_text,
+        ema_model,
+        vocoder,
+        cross_fade_duration=cross_fade_duration,
+        speed=speed,
+        nfe_step=nfe_step or None,
+        cfg_schedule=cfg_schedule,
+        indic=indic,
+        show_info=show_info,
+    ):
+        yield (target_sample_rate, audio), ref_text
+
+
 with gr.Blocks() as app_credits:
     gr.Markdown("""
 # Credits
@@ -207,14 +247,36 @@ with gr.Blocks() as app_tts:
         )
         nfe_slider = gr.Slider(
             label="NFE Steps",
-            minimum=4,
+            minimum=0,
             maximum=64,
-            value=32,
+            value=0,
             step=2,
-            info="Set the number of denoising steps.",
+            info="Set the number of denoising steps, 0 for the model's default: 32, or the native steps of a few-step distilled model.",
+        )
+        cfg_interval_start_slider = gr.Slider(
+            label="CFG Interval Start",
+            minimum=0.0,
+            maximum=1.0,
+            value=0.0,
+            step=0.05,
+            info="Apply classifier-free guidance only from this flow time on. Steps outside the interval skip the unconditional pass and run faster.",
+        )
+        cfg_interval_end_slider = gr.Slider(
+            label="CFG Interval End",
+            minimum=0.0,
+            maximum=1.0,
+            value=1.0,
+            step=0.05,
+            info="Apply classifier-free guidance only up to this flow time.",
+        )
+        stream_checkbox = gr.Checkbox(
+            label="Stream Audio",
+            info="Play the audio chunk by chunk while the rest is still generated, instead of once it is complete. No spectrogram and no silence removal when streaming.",
+            value=False,
         )
 
     audio_output = gr.Audio(label="Synthesized Audio")
+    audio_stream_output = gr.Audio(label="Streamed Audio", streaming=True, autoplay=True)
     spectrogram_output = gr.Image(label="Spectrogram")
 
     @gpu_decorator
@@ -226,7 +288,27 @@ with gr.Blocks() as app_tts:
         nfe_slider,
         cross_fade_duration_slider,
         speed_slider,
+        cfg_interval_start_slider,
+        cfg_interval_end_slider,
+        stream_checkbox,
     ):
+        if cfg_interval_start_slider > 0 or cfg_interval_end_slider < 1:
+            cfg_schedule = (cfg_interval_start_slider, cfg_interval_end_slider)
+        else:
+            cfg_schedule = None
+        if stream_checkbox:
+            for audio_out, ref_text_out in infer_stream(
+                ref_audio_input,
+                ref_text_input,
+                gen_text_input,
+                tts_model_choice,
+                nfe_slider,
+                cross_fade_duration_slider,
+                speed_slider,
+                cfg_schedule=cfg_schedule,
+            ):
+                yield gr.update(), audio_out, gr.update(), gr.update(value=ref_text_out)
+            return
         audio_out, spectrogram_path, ref_text_out = infer(
             ref_audio_input,
             ref_text_input,
@@ -236,8 +318,9 @@ with gr.Blocks() as app_tts:
             nfe_slider,
             cross_fade_duration_slider,
             speed_slider,
+            cfg_schedule=cfg_schedule,
         )
-        return audio_out, spectrogram_path, gr.update(value=ref_text_out)
+        yield audio_out, gr.update(), spectrogram_path, gr.update(value=ref_text_out)
 
     generate_btn.click(
         basic_tts,
@@ -249,8 +332,11 @@ with gr.Blocks() as app_tts:
             nfe_slider,
             cross_fade_duration_slider,
             speed_slider,
+            cfg_interval_start_slider,
+            cfg_interval_end_slider,
+            stream_checkbox,
         ],
-        outputs=[audio_output, spectrogram_output, ref_text_input],
+        outputs=[audio_output, audio_stream_output, spectrogram_output, ref_text_input],
     )
 
 
@@ -862,8 +948,16 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
     type=str,
     help='The root path (or "mount point") of the application, if it\'s not served from the root ("/") of the domain. Often used when the application is behind a reverse proxy that forwards requests to the application, e.g. set "/myapp" or full URL for application served at "https://example.com/myapp".',
 )
-def main(port, host, share, api, root_path):
+@click.option(
+    "--max_model_gb",
+    default=None,
+    type=float,
+    help="Memory budget of resident TTS models, least recently used ones are unloaded past it (default: no limit)",
+)
+def main(port, host, share, api, root_path, max_model_gb):
     global app
+    if max_model_gb is not None:
+        set_model_budget(int(max_model_gb * 1024**3))
     print("Starting app...")
     app.queue(api_open=api).launch(server_name=host, server_port=port, share=share, show_api=api, root_path=root_path)
 
@@ -6,7 +6,7 @@ import torch
 import torch.nn.functional as F
 import torchaudio
 
-from f5_tts.infer.utils_infer import load_checkpoint, load_vocoder, save_spectrogram
+from f5_tts.infer.utils_infer import decode_mel, load_checkpoint, load_vocoder, save_spectrogram
 from f5_tts.model import CFM, DiT, UNetT
 from f5_tts.model.utils import convert_char_to_pinyin, get_tokenizer
 
@@ -36,9 +36,11 @@ ckpt_step = 1200000
 
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
-ode_method = "euler"  # euler | midpoint
+ode_method = "euler"  # euler | midpoint | heun | ab2 | ab3
 sway_sampling_coef = -1.0
 speed = 1.0
+vocoder_max_frames = None  # None | e.g. 2048, vocode long edits in overlapping windows to bound memory
+vocoder_num_workers = 1  # windows vocoded at a time, each on its own thread
 
 if exp_name == "F5TTS_Base":
     model_cls = DiT
@@ -180,10 +182,9 @@ with torch.inference_mode():
     generated = generated.to(torch.float32)
     generated = generated[:, ref_audio_len:, :]
     gen_mel_spec = generated.permute(0, 2, 1)
-    if mel_spec_type == "vocos":
-        generated_wave = vocoder.decode(gen_mel_spec).cpu()
-    elif mel_spec_type == "bigvgan":
-        generated_wave = vocoder(gen_mel_spec).squeeze(0).cpu()
+    generated_wave = decode_mel(
+        vocoder, gen_mel_spec, mel_spec_type, vocoder_max_frames, num_workers=vocoder_num_workers
+    ).cpu()
 
     if rms < target_rms:
         generated_wave = generated_wave * rms / target_rms
@@ -1,39 +1,57 @@
 # A unified script for inference process
 # Make adjustments inside functions, and consider both gradio and cli scripts if need to change func output format
+# Heavy imports (transformers, vocos, huggingface_hub, matplotlib) are made inside the functions using them,
+# keep them out of module scope so that cli and worker starts stay fast
 import os
 import sys
 
 os.environ["PYTOCH_ENABLE_MPS_FALLBACK"] = "1"  # for MPS device compatibility
 sys.path.append(f"../../{os.path.dirname(os.path.abspath(__file__))}/third_party/BigVGAN/")
 
+import contextlib
+import functools
+import gc
 import hashlib
+import itertools
+import math
 import re
 import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from importlib.resources import files
 
-import matplotlib
-
-matplotlib.use("Agg")
-
-import matplotlib.pylab as plt
 import numpy as np
+import soundfile as sf
 import torch
 import torchaudio
 import tqdm
-from huggingface_hub import snapshot_download, hf_hub_download
-from pydub import AudioSegment, silence
-from transformers import pipeline
-from vocos import Vocos
 
 from f5_tts.model import CFM
 from f5_tts.model.utils import (
+    RefPrompt,
     get_tokenizer,
     convert_char_to_pinyin,
+    split_ref_text,
 )
 
-_ref_audio_cache = {}
 
-device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+# default device, probed on first use rather than at import, device=None arguments below resolve to it
+
+
+@functools.cache
+def get_default_device():
+    return "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+
+
+def __getattr__(name):
+    # utils_infer.device, as before the probe was deferred
+    if name == "device":
+        return get_default_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # -----------------------------------------
 
@@ -45,12 +63,21 @@ n_fft = 1024
 mel_spec_type = "vocos"
 target_rms = 0.1
 cross_fade_duration = 0.15
-ode_method = "euler"
-nfe_step = 32  # 16, 32
+cross_fade_curve = "linear"  # linear | equal_power
+ode_method = "euler"  # euler | midpoint | heun | ab2 | ab3 (multistep, for fewer nfe)
+nfe_step = None  # 16, 32. None for 32, or the native steps of a few-step distilled model
 cfg_strength = 2.0
+cfg_schedule = None  # None | (t_lo, t_hi) to skip the null pass outside | "linear" | "cosine", see get_cfg_strength()
+block_cache = None  # None | dict(interval=3) etc., reuse middle DiT blocks across steps, see DiT.get_block_cache()
 sway_sampling_coef = -1.0
 speed = 1.0
 fix_duration = None
+first_chunk_chars = 40  # streaming: first chunk of about one clause, later chunks grow to max_chars, see chunk_text()
+first_nfe_step = None  # streaming: fewer steps for the first chunk only, to start audio sooner
+pipeline_vocoder = True  # vocode a chunk while the next one is sampled, see infer_chunks()
+max_batch_frames = 16384  # padded mel frames (batch x longest duration) per sample call, see infer_chunk_batches()
+vocoder_max_frames = None  # None | mel frames per vocoder call, longer mels in overlapping windows, see decode_mel()
+vocoder_num_workers = 1  # vocoder calls at a time on those windows, each on its own thread
 
 # -----------------------------------------
 
@@ -58,29 +85,39 @@ fix_duration = None
 # chunk text into smaller pieces
 
 
-def chunk_text(text, max_chars=135):
+def chunk_text(text, max_chars=135, first_chars=None, per_sentence=False):
     """
     Splits the input text into chunks, each with a maximum number of characters.
 
     Args:
         text (str): The text to be split.
         max_chars (int): The maximum number of characters per chunk.
+        first_chars (int, optional): For streaming, a smaller budget for the first chunk, doubled for each
+            following chunk up to max_chars.
+        per_sentence (bool): Never join sentences into one chunk, so that texts sharing a sentence share its
+            chunks, for the output cache.
 
     Returns:
         List[str]: A list of text chunks.
     """
     chunks = []
     current_chunk = ""
+    budget = max_chars if first_chars is None else min(first_chars, max_chars)
     # Split the text into sentences based on punctuation followed by whitespace
     sentences = re.split(r"(?<=[;:,.!?])\s+|(?<=[；：，。！？])", text)
 
     for sentence in sentences:
-        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= max_chars:
+        if len(current_chunk.encode("utf-8")) + len(sentence.encode("utf-8")) <= budget:
             current_chunk += sentence + " " if sentence and len(sentence[-1].encode("utf-8")) == 1 else sentence
         else:
             if current_chunk:
                 chunks.append(current_chunk.strip())
+                budget = min(budget * 2, max_chars)
             current_chunk = sentence + " " if sentence and len(sentence[-1].encode("utf-8")) == 1 else sentence
+        if per_sentence and re.search(r"[.!?。！？]$", sentence) and current_chunk:
+            chunks.append(current_chunk.strip())
+            budget = min(budget * 2, max_chars)
+            current_chunk = ""
 
     if current_chunk:
         chunks.append(current_chunk.strip())
@@ -89,8 +126,13 @@ def chunk_text(text, max_chars=135):
 
 
 # load vocoder
-def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=device, hf_cache_dir=None):
+def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=None, hf_cache_dir=None):
+    device = device or get_default_device()
+    from huggingface_hub import hf_hub_download, snapshot_download
+
     if vocoder_name == "vocos":
+        from vocos import Vocos
+
         # vocoder = Vocos.from_pretrained("charactr/vocos-mel-24khz").to(device)
         if is_local:
             print(f"Load vocos from local path {local_path}")
@@ -130,16 +172,83 @@ def load_vocoder(vocoder_name="vocos", is_local=False, local_path="", device=dev
     return vocoder
 
 
+# vocode mel (b d n) -> wave (b n*hop). past max_frames (batch x frames per vocoder call), the mel is decoded in
+# overlapping windows of window_frames, batched up to max_frames, and overlap-added with weights that ramp over
+# the overlaps. num_workers vocoder calls at a time, each on its own thread
+
+
+def decode_mel(
+    vocoder,
+    mel,
+    mel_spec_type=mel_spec_type,
+    max_frames=vocoder_max_frames,
+    window_frames=512,
+    overlap_frames=32,
+    num_workers=vocoder_num_workers,
+):
+    def decode(mel):
+        with torch.inference_mode():
+            if mel_spec_type == "vocos":
+                return vocoder.decode(mel)
+            elif mel_spec_type == "bigvgan":
+                return vocoder(mel).squeeze(1)
+
+    batch, _, frames = mel.shape
+    if max_frames is None or batch * frames <= max_frames:
+        return decode(mel)
+
+    # windows of equal length, the last one aligned to the end of the mel
+    window_frames = min(window_frames, max_frames, frames)
+    overlap_frames = min(overlap_frames, window_frames // 2)
+    starts = list(range(0, frames - window_frames, window_frames - overlap_frames)) + [frames - window_frames]
+    windows = [(i, start) for i in range(batch) for start in starts]
+    per_call = max(max_frames // window_frames, 1)
+    groups = [windows[k : k + per_call] for k in range(0, len(windows), per_call)]
+
+    # ramps strictly between 0 and 1, so every sample has some weight, whatever the overlap of the last window
+    window_len, overlap_len = window_frames * hop_length, overlap_frames * hop_length
+    ramp = torch.linspace(0, 1, overlap_len + 2, device=mel.device)[1:-1]
+    tapers, weight = {}, torch.zeros(frames * hop_length, device=mel.device)
+    for start in starts:
+        taper = torch.ones(window_len, device=mel.device)
+        if start > 0:
+            taper[:overlap_len] = ramp
+        if start + window_frames < frames:
+            taper[window_len - overlap_len :] = ramp.flip(0)
+        tapers[start] = taper
+        weight[start * hop_length : start * hop_length + window_len] += taper
+
+    def decode_group(group):
+        return decode(torch.stack([mel[i, :, start : start + window_frames] for i, start in group]))
+
+    wave = None
+    executor = ThreadPoolExecutor(num_workers) if num_workers > 1 else None
+    try:
+        decoded = executor.map(decode_group, groups) if executor else map(decode_group, groups)
+        for group, group_waves in zip(groups, decoded):
+            if wave is None:
+                wave = torch.zeros(batch, frames * hop_length, device=group_waves.device, dtype=group_waves.dtype)
+            for (i, start), window_wave in zip(group, group_waves):
+                wave[i, start * hop_length : start * hop_length + window_len] += window_wave * tapers[start]
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return wave / weight
+
+
 # load asr pipeline
 
 asr_pipe = None
 
 
-def initialize_asr_pipeline(device: str = device, dtype=None):
+def initialize_asr_pipeline(device: str | None = None, dtype=None):
+    device = device or get_default_device()
     if dtype is None:
         dtype = (
             torch.float16 if "cuda" in device and torch.cuda.get_device_properties(device).major >= 6 else torch.float32
         )
+    from transformers import pipeline
+
     global asr_pipe
     asr_pipe = pipeline(
         "automatic-speech-recognition",
@@ -155,7 +264,7 @@ def initialize_asr_pipeline(device: str = device, dtype=None):
 def transcribe(ref_audio, language=None):
     global asr_pipe
     if asr_pipe is None:
-        initialize_asr_pipeline(device=device)
+        initialize_asr_pipeline()
     return asr_pipe(
         ref_audio,
         chunk_length_s=30,
@@ -174,41 +283,72 @@ def load_checkpoint(model, ckpt_path, device: str, dtype=None, use_ema=True):
             torch.float16 if "cuda" in device and torch.cuda.get_device_properties(device).major >= 6 else torch.float32
         )
     model = model.to(dtype)
+    target = model.state_dict()  # dtype of each entry, also from a model with weights on meta device
+
+    # tensors read one by one from the memory-mapped file, renamed, cast & moved, then assigned to the model as is,
+    # so with a model built on meta device (see load_model()) about one copy of the weights is held at peak
+    def get_state_dict(keys, get_tensor):
+        state_dict = {}
+        for key in keys:
+            if use_ema:
+                if key in ["initted", "step"]:
+                    continue
+                name = key.replace("ema_model.", "")
+                # patch for backward compatibility, 305e3ea
+                if name in ["mel_spec.mel_stft.mel_scale.fb", "mel_spec.mel_stft.spectrogram.window"]:
+                    continue
+            else:
+                name = key
+            tensor = get_tensor(key)
+            state_dict[name] = tensor.to(device, target[name].dtype) if name in target else tensor
+        return state_dict
 
     ckpt_type = ckpt_path.split(".")[-1]
     if ckpt_type == "safetensors":
-        from safetensors.torch import load_file
-
-        checkpoint = load_file(ckpt_path, device=device)
-    else:
-        checkpoint = torch.load(ckpt_path, map_location=device, weights_only=True)
-
-    if use_ema:
-        if ckpt_type == "safetensors":
-            checkpoint = {"ema_model_state_dict": checkpoint}
-        checkpoint["model_state_dict"] = {
-            k.replace("ema_model.", ""): v
-            for k, v in checkpoint["ema_model_state_dict"].items()
-            if k not in ["initted", "step"]
-        }
-
-        # patch for backward compatibility, 305e3ea
-        for key in ["mel_spec.mel_stft.mel_scale.fb", "mel_spec.mel_stft.spectrogram.window"]:
-            if key in checkpoint["model_state_dict"]:
-                del checkpoint["model_state_dict"][key]
-
-        model.load_state_dict(checkpoint["model_state_dict"])
+        from safetensors import safe_open
+
+        with safe_open(ckpt_path, framework="pt") as f:
+            metadata = f.metadata() or {}
+            state_dict = get_state_dict(f.keys(), f.get_tensor)
+        native_steps = int(metadata["native_steps"]) if "native_steps" in metadata else None
+        distilled_cfg_strength = (
+            float(metadata["distilled_cfg_strength"]) if "distilled_cfg_strength" in metadata else None
+        )
     else:
-        if ckpt_type == "safetensors":
-            checkpoint = {"model_state_dict": checkpoint}
-        model.load_state_dict(checkpoint["model_state_dict"])
-
-    del checkpoint
+        checkpoint = torch.load(ckpt_path, map_location="cpu", weights_only=True, mmap=True)
+        native_steps = checkpoint.get("native_steps")
+        distilled_cfg_strength = checkpoint.get("distilled_cfg_strength")
+        source = checkpoint["ema_model_state_dict" if use_ema else "model_state_dict"]
+        state_dict = get_state_dict(source.keys(), source.__getitem__)
+        del checkpoint, source
+
+    if native_steps is not None:  # few-step distilled student
+        model.native_steps = native_steps
+    if distilled_cfg_strength is not None:  # guidance-distilled, samples without the null branch
+        model.distilled_cfg_strength = distilled_cfg_strength
+
+    model.load_state_dict(state_dict, assign=True)
+    del state_dict
+    if isinstance(model, CFM):  # time conditioning computed from the previous weights
+        model.clear_time_cond_cache()
     torch.cuda.empty_cache()
 
     return model.to(device)
 
 
+# cheap fingerprint of a checkpoint file from its size & blocks spread over it, to tell models apart in cache keys
+
+
+def get_checkpoint_id(ckpt_path, num_blocks=16, block_size=256 * 1024):
+    size = os.path.getsize(ckpt_path)
+    md5 = hashlib.md5(str(size).encode("utf-8"))
+    with open(ckpt_path, "rb") as f:
+        for i in range(num_blocks):
+            f.seek(max(size - block_size, 0) * i // (num_blocks - 1))
+            md5.update(f.read(block_size))
+    return md5.hexdigest()
+
+
 # load model for inference
 
 
@@ -220,7 +360,8 @@ def load_model(
     vocab_file="",
     ode_method=ode_method,
     use_ema=True,
-    device=device,
+    device=None,
+    dtype=None,
 ):
     if vocab_file == "":
         vocab_file = str(files("f5_tts").joinpath("infer/examples/vocab.txt"))
@@ -231,103 +372,477 @@ def load_model(
     print("model : ", ckpt_path, "\n")
 
     vocab_char_map, vocab_size = get_tokenizer(vocab_file, tokenizer)
-    model = CFM(
-        transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
-        mel_spec_kwargs=dict(
-            n_fft=n_fft,
-            hop_length=hop_length,
-            win_length=win_length,
-            n_mel_channels=n_mel_channels,
-            target_sample_rate=target_sample_rate,
-            mel_spec_type=mel_spec_type,
-        ),
-        odeint_kwargs=dict(
-            method=ode_method,
-        ),
-        vocab_char_map=vocab_char_map,
-    ).to(device)
 
-    dtype = torch.float32 if mel_spec_type == "bigvgan" else None
-    model = load_checkpoint(model, ckpt_path, device, dtype=dtype, use_ema=use_ema)
+    # weights on meta device, no memory or random init spent on them, load_checkpoint() assigns the loaded ones
+    from accelerate import init_empty_weights
+
+    with init_empty_weights(include_buffers=False):
+        model = CFM(
+            transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
+            mel_spec_kwargs=dict(
+                n_fft=n_fft,
+                hop_length=hop_length,
+                win_length=win_length,
+                n_mel_channels=n_mel_channels,
+                target_sample_rate=target_sample_rate,
+                mel_spec_type=mel_spec_type,
+            ),
+            odeint_kwargs=dict(
+                method=ode_method,
+            ),
+            vocab_char_map=vocab_char_map,
+        )
+
+    dtype = torch.float32 if mel_spec_type == "bigvgan" else dtype
+    model = load_checkpoint(model, ckpt_path, device or get_default_device(), dtype=dtype, use_ema=use_ema)
+    model.ckpt_id = get_checkpoint_id(ckpt_path)  # identifies the model in output cache keys
+    if model.native_steps is not None:
+        print(f"few-step distilled model, native steps: {model.native_steps}")
+    if model.distilled_cfg_strength is not None:
+        print(f"guidance-distilled model, cfg strength: {model.distilled_cfg_strength} (no unconditional pass)")
 
     return model
 
 
-def remove_silence_edges(audio, silence_threshold=-42):
-    # Remove silence from the start
-    non_silent_start_idx = silence.detect_leading_silence(audio, silence_threshold=silence_threshold)
-    audio = audio[non_silent_start_idx:]
+# resident models & vocoders shared by api, cli, gradio & socket server, each loaded once per settings and device.
+# least recently used models are dropped once their weights together exceed max_bytes (None: keep all), vocoders
+# are small and shared by all models so always kept. a dropped model is freed once callers release it, until then
+# it counts against max_bytes and is taken back by get_model() rather than loaded a second time
+
+
+class ModelRegistry:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()  # key -> model, least recently used first
+        self.vocoders = OrderedDict()
+        self.loading = {}  # key -> lock held while that key loads
+        self.released = weakref.WeakValueDictionary()  # key -> dropped model, while callers still hold it
+        self.lock = threading.Lock()  # guards lookups & inserts only, loads run outside it
+
+    @staticmethod
+    def model_bytes(model):
+        return sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+
+    def get_or_load(self, entries, key, load):
+        # concurrent requests for a key wait for its single load, other keys and resident entries are served meanwhile
+        with self.lock:
+            if key in entries:
+                entries.move_to_end(key)
+                return entries[key], False
+            value = self.released.pop(key, None)
+            if value is not None:
+                entries[key] = value
+                return value, False
+            key_lock = self.loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key], False
+            value = load()
+            with self.lock:
+                entries[key] = value
+                self.loading.pop(key, None)
+            return value, True
+
+    def get_vocoder(self, vocoder_name="vocos", is_local=False, local_path="", device=None, hf_cache_dir=None):
+        device = device or get_default_device()
+        key = (vocoder_name, is_local, local_path, str(device))
+        vocoder, _ = self.get_or_load(
+            self.vocoders, key, lambda: load_vocoder(vocoder_name, is_local, local_path, device, hf_cache_dir)
+        )
+        return vocoder
 
-    # Remove silence from the end
-    non_silent_end_duration = audio.duration_seconds
-    for ms in reversed(audio):
-        if ms.dBFS > silence_threshold:
-            break
-        non_silent_end_duration -= 0.001
-    trimmed_audio = audio[: int(non_silent_end_duration * 1000)]
+    def get_model(
+        self,
+        model_cls,
+        model_cfg,
+        ckpt_path,
+        mel_spec_type=mel_spec_type,
+        vocab_file="",
+        ode_method=ode_method,
+        use_ema=True,
+        device=None,
+        dtype=None,
+        show_info=None,
+    ):
+        device = device or get_default_device()
+        settings = (mel_spec_type, vocab_file, ode_method, use_ema, str(device), str(dtype))
+        key = repr((model_cls.__name__, sorted(model_cfg.items()), ckpt_path, settings))
+
+        def load():
+            if show_info is not None:
+                show_info(f"Loading {model_cls.__name__} model {ckpt_path}...")
+            return load_model(
+                model_cls, model_cfg, ckpt_path, mel_spec_type, vocab_file, ode_method, use_ema, device, dtype
+            )
 
-    return trimmed_audio
+        model, loaded = self.get_or_load(self.models, key, load)
+        if loaded:
+            with self.lock:
+                self.evict()
+        return model
+
+    def evict(self):
+        # the most recent model is kept, even alone over budget. resident bytes are rechecked after each drop, as a
+        # model still held by a caller stays in memory
+        evicted = False
+        while self.max_bytes is not None and len(self.models) > 1:
+            resident = itertools.chain(self.models.values(), self.released.values())
+            if sum(self.model_bytes(model) for model in resident) <= self.max_bytes:
+                break
+            key, model = self.models.popitem(last=False)
+            self.released[key] = model
+            del model
+            gc.collect()
+            evicted = True
+        if evicted:
+            torch.cuda.empty_cache()
+
+
+model_registry = ModelRegistry()  # no memory budget by default, see set_model_budget()
+
+
+def set_model_budget(max_bytes=None):
+    with model_registry.lock:
+        model_registry.max_bytes = max_bytes
+        model_registry.evict()
+    return model_registry
+
+
+# silence detection on float audio (channels n), same rules as pydub.silence with positions in ms,
+# rms of all windows at once from a cumulative sum of squares instead of slicing the audio window by window
+
+
+def frame_rms(wave, starts, ends):
+    power = np.square(wave, dtype=np.float64).mean(axis=0)
+    cumsum = np.concatenate(([0.0], np.cumsum(power)))
+    starts = np.minimum(starts, len(power))
+    ends = np.minimum(ends, len(power))
+    return np.sqrt((cumsum[ends] - cumsum[starts]) / np.maximum(ends - starts, 1))
+
+
+def detect_nonsilent(wave, sr, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    seg_len = round(1000 * wave.shape[-1] / sr)
+    if seg_len < min_silence_len:
+        return [[0, seg_len]]
+
+    # silent windows of min_silence_len, checked every seek_step
+    last_start = seg_len - min_silence_len
+    starts = np.arange(0, last_start + 1, seek_step)
+    if last_start % seek_step:
+        starts = np.append(starts, last_start)
+    rms = frame_rms(wave, starts * sr // 1000, (starts + min_silence_len) * sr // 1000)
+    silence_starts = starts[rms <= 10 ** (silence_thresh / 20)]
+    if len(silence_starts) == 0:
+        return [[0, seg_len]]
+
+    # combine into silent ranges, overlapping windows (or adjacent at seek_step) join
+    gaps = np.diff(silence_starts)
+    breaks = np.nonzero((gaps != seek_step) & (gaps > min_silence_len))[0]
+    range_starts = silence_starts[np.concatenate(([0], breaks + 1))].tolist()
+    range_ends = (silence_starts[np.concatenate((breaks, [len(silence_starts) - 1]))] + min_silence_len).tolist()
+    if range_starts[0] == 0 and range_ends[0] == seg_len:
+        return []
+
+    nonsilent_ranges = [[start, end] for start, end in zip([0] + range_ends, range_starts)]
+    if range_ends[-1] != seg_len:
+        nonsilent_ranges.append([range_ends[-1], seg_len])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+
+    return nonsilent_ranges
+
+
+def split_on_silence(wave, sr, min_silence_len=1000, silence_thresh=-16, keep_silence=100, seek_step=1):
+    output_ranges = [
+        [start - keep_silence, end + keep_silence]
+        for start, end in detect_nonsilent(wave, sr, min_silence_len, silence_thresh, seek_step)
+    ]
+    # silence shorter than twice keep_silence is split evenly between neighbours
+    for range_i, range_ii in itertools.pairwise(output_ranges):
+        if range_ii[0] < range_i[1]:
+            range_i[1] = (range_i[1] + range_ii[0]) // 2
+            range_ii[0] = range_i[1]
+
+    seg_len = round(1000 * wave.shape[-1] / sr)
+    return [wave[:, max(start, 0) * sr // 1000 : min(end, seg_len) * sr // 1000] for start, end in output_ranges]
+
+
+def remove_silence_edges(wave, sr, silence_threshold=-42):
+    silence_thresh = 10 ** (silence_threshold / 20)
+
+    # Remove silence from the start, checked in 10ms chunks
+    seg_len = round(1000 * wave.shape[-1] / sr)
+    starts = np.arange(0, seg_len, 10)
+    loud = np.nonzero(frame_rms(wave, starts * sr // 1000, (starts + 10) * sr // 1000) >= silence_thresh)[0]
+    non_silent_start = starts[loud[0]] if len(loud) else seg_len
+    wave = wave[:, non_silent_start * sr // 1000 :]
+
+    # Remove silence from the end, checked in 1ms steps
+    seg_len = round(1000 * wave.shape[-1] / sr)
+    starts = np.arange(seg_len)
+    loud = np.nonzero(frame_rms(wave, starts * sr // 1000, (starts + 1) * sr // 1000) > silence_thresh)[0]
+    non_silent_end = loud[-1] + 1 if len(loud) else 0
+
+    return wave[:, : non_silent_end * sr // 1000]
+
+
+# cache of processed reference voices: clipped audio & asr transcript keyed by hash of the input file bytes,
+# mel & rms keyed by hash of the clipped audio. lru evicted, by entries in memory and by bytes on disk (optional)
+
+
+class VoiceCache:
+    def __init__(self, cache_dir=None, max_items=256, max_disk_bytes=2 * 1024**3):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()  # key -> entry dict, least recently used first
+        self.lock = threading.Lock()  # entries shared by the threads of a server
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        md5 = hashlib.md5()
+        for part in parts:
+            md5.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        return md5.hexdigest()
+
+    def path(self, key, suffix=".pt"):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.cache_dir is None:
+            return None
+        try:
+            entry = torch.load(self.path(key), map_location="cpu", weights_only=True)
+            os.utime(self.path(key))  # mark as recently used for disk eviction
+        except FileNotFoundError:  # not cached, or evicted by another process
+            return None
+        self.remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self.remember(key, entry)
+        if self.cache_dir is not None:
+            torch.save(entry, self.path(key))
+            self.evict_disk(keep=key)
+
+    def remember(self, key, entry):
+        evicted = []
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                evicted.append(self.entries.popitem(last=False)[1])
+        if self.cache_dir is None:  # clipped reference audio in a temporary file, see preprocess_ref_audio_text()
+            for evicted_entry in evicted:
+                if "ref_audio" in evicted_entry:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(evicted_entry["ref_audio"])
+
+    def evict_disk(self, keep=None):
+        # files of one key (.pt entry, .wav audio) go together, by last use of the entry
+        groups = {}
+        for name in os.listdir(self.cache_dir):
+            key, _ = os.path.splitext(name)
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue  # removed by another process meanwhile
+            size, mtime = groups.get(key, (0, 0))
+            groups[key] = (size + stat.st_size, max(mtime, stat.st_mtime) if name.endswith(".pt") else mtime)
+        total = sum(size for size, _ in groups.values())
+        for key in sorted(groups, key=lambda key: groups[key][1]):
+            if total <= self.max_disk_bytes:
+                break
+            if key == keep:
+                continue
+            for suffix in (".pt", ".wav"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.path(key, suffix))
+            with self.lock:
+                self.entries.pop(key, None)
+            total -= groups[key][0]
 
 
-# preprocess reference audio and text
+voice_cache = VoiceCache()  # in memory only by default, see set_voice_cache()
+
 
+def set_voice_cache(cache_dir=None, max_items=256, max_disk_bytes=2 * 1024**3):
+    # with cache_dir, processed voices persist across processes
+    global voice_cache
+    voice_cache = VoiceCache(cache_dir=cache_dir, max_items=max_items, max_disk_bytes=max_disk_bytes)
+    return voice_cache
 
-def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=device):
-    show_info("Converting audio...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
 
-        if clip_short:
-            # 1. try to find long silence for clipping
-            non_silent_segs = silence.split_on_silence(
-                aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
+# cache of generated audio for repeated requests, per text chunk (a sentence, see chunk_text(per_sentence)), keyed by
+# voice, text, model checkpoint & all sampling settings incl. an explicit seed. flac files on disk, dropped when
+# unused for max_age seconds, and least recently used first past max_disk_bytes
+
+
+class OutputCache:
+    def __init__(self, cache_dir, max_disk_bytes=4 * 1024**3, max_age=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    key = staticmethod(VoiceCache.key)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".flac")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.max_age:
+                os.remove(path)
+                return None
+            wave, _ = sf.read(path, dtype="float32")
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, RuntimeError):  # not cached, or removed by another process meanwhile
+            return None
+        return wave
+
+    def put(self, key, wave):
+        # written aside then renamed, so that processes sharing the cache never read a partial file
+        tmp_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        sf.write(tmp_path, wave, target_sample_rate, format="FLAC", subtype="PCM_24")
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".flac"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, name)))
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_disk_bytes and now - mtime <= self.max_age:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+output_cache = None  # off by default, see set_output_cache()
+
+
+def set_output_cache(cache_dir=None, max_disk_bytes=4 * 1024**3, max_age=30 * 24 * 3600):
+    # only requests with an explicit seed, on a model from load_model(), are cached
+    global output_cache
+    output_cache = None if cache_dir is None else OutputCache(cache_dir, max_disk_bytes, max_age)
+    return output_cache
+
+
+def get_output_key(prompt, gen_text, model_obj, **settings):
+    # reference audio & text through the prompt, gen text with whitespace normalized
+    return output_cache.key(
+        prompt.mel.cpu().numpy().tobytes(),
+        prompt.text,
+        prompt.rms,
+        " ".join(gen_text.split()),
+        model_obj.ckpt_id,
+        model_obj.odeint_kwargs,
+        sorted(settings.items()),
+    )
+
+
+# clip reference audio to at most 15s at silences, trim silent edges
+
+
+def clip_ref_audio(ref_audio_orig, clip_short=True, show_info=print):
+    wave, sr = torchaudio.load(ref_audio_orig)
+    wave = wave.numpy()
+
+    def length(segs):  # in ms
+        return round(1000 * sum(seg.shape[-1] for seg in segs) / sr)
+
+    if clip_short:
+        # 1. try to find long silence for clipping
+        non_silent_segs = split_on_silence(
+            wave, sr, min_silence_len=1000, silence_thresh=-50, keep_silence=1000, seek_step=10
+        )
+        non_silent_wave = []
+        for non_silent_seg in non_silent_segs:
+            if length(non_silent_wave) > 6000 and length(non_silent_wave + [non_silent_seg]) > 15000:
+                show_info("Audio is over 15s, clipping short. (1)")
+                break
+            non_silent_wave.append(non_silent_seg)
+
+        # 2. try to find short silence for clipping if 1. failed
+        if length(non_silent_wave) > 15000:
+            non_silent_segs = split_on_silence(
+                wave, sr, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
             )
-            non_silent_wave = AudioSegment.silent(duration=0)
+            non_silent_wave = []
             for non_silent_seg in non_silent_segs:
-                if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                    show_info("Audio is over 15s, clipping short. (1)")
+                if length(non_silent_wave) > 6000 and length(non_silent_wave + [non_silent_seg]) > 15000:
+                    show_info("Audio is over 15s, clipping short. (2)")
                     break
-                non_silent_wave += non_silent_seg
-
-            # 2. try to find short silence for clipping if 1. failed
-            if len(non_silent_wave) > 15000:
-                non_silent_segs = silence.split_on_silence(
-                    aseg, min_silence_len=100, silence_thresh=-40, keep_silence=1000, seek_step=10
-                )
-                non_silent_wave = AudioSegment.silent(duration=0)
-                for non_silent_seg in non_silent_segs:
-                    if len(non_silent_wave) > 6000 and len(non_silent_wave + non_silent_seg) > 15000:
-                        show_info("Audio is over 15s, clipping short. (2)")
-                        break
-                    non_silent_wave += non_silent_seg
-
-            aseg = non_silent_wave
-
-            # 3. if no proper silence found for clipping
-            if len(aseg) > 15000:
-                aseg = aseg[:15000]
-                show_info("Audio is over 15s, clipping short. (3)")
-
-        aseg = remove_silence_edges(aseg) + AudioSegment.silent(duration=50)
-        aseg.export(f.name, format="wav")
-        ref_audio = f.name
-
-    # Compute a hash of the reference audio file
-    with open(ref_audio, "rb") as audio_file:
-        audio_data = audio_file.read()
-        audio_hash = hashlib.md5(audio_data).hexdigest()
+                non_silent_wave.append(non_silent_seg)
+
+        wave = np.concatenate([wave[:, :0]] + non_silent_wave, axis=-1)
+
+        # 3. if no proper silence found for clipping
+        if length([wave]) > 15000:
+            wave = wave[:, : 15000 * sr // 1000]
+            show_info("Audio is over 15s, clipping short. (3)")
+
+    wave = remove_silence_edges(wave, sr)
+    wave = np.concatenate((wave, np.zeros((wave.shape[0], 50 * sr // 1000), dtype=wave.dtype)), axis=-1)
+
+    return wave, sr
+
+
+# preprocess reference audio and text
+
+
+def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_info=print, device=None):
+    # a returning voice skips decoding, clipping and transcription
+    with open(ref_audio_orig, "rb") as audio_file:
+        voice_key = voice_cache.key(audio_file.read(), f"clip_short={clip_short}")
+    voice = voice_cache.get(voice_key)
+    if voice is not None and not os.path.exists(voice["ref_audio"]):
+        voice = None
+
+    if voice is None:
+        show_info("Converting audio...")
+        wave, sr = clip_ref_audio(ref_audio_orig, clip_short=clip_short, show_info=show_info)
+        if voice_cache.cache_dir is not None:  # kept next to the cache entry, evicted with it
+            ref_audio = voice_cache.path(voice_key, ".wav")
+        else:  # removed once the entry is evicted from memory
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+                ref_audio = f.name
+        sf.write(ref_audio, wave.T, sr, subtype="PCM_16")
+        voice = dict(ref_audio=ref_audio)
+        voice_cache.put(voice_key, voice)
+    ref_audio = voice["ref_audio"]
 
     if not ref_text.strip():
-        global _ref_audio_cache
-        if audio_hash in _ref_audio_cache:
+        if "ref_text" in voice:
             # Use cached asr transcription
             show_info("Using cached reference text...")
-            ref_text = _ref_audio_cache[audio_hash]
+            ref_text = voice["ref_text"]
         else:
             show_info("No reference text provided, transcribing reference audio...")
             ref_text = transcribe(ref_audio)
             # Cache the transcribed text (not caching custom ref_text, enabling users to do manual tweak)
-            _ref_audio_cache[audio_hash] = ref_text
+            voice_cache.put(voice_key, dict(voice, ref_text=ref_text))
     else:
         show_info("Using custom reference text...")
 
@@ -343,6 +858,128 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, clip_short=True, show_in
     return ref_audio, ref_text
 
 
+# mono, loudness-normalized, resampled reference audio and its original rms
+
+
+def prepare_ref_audio(ref_audio, target_rms=target_rms, device=None):
+    device = device or get_default_device()
+    audio, sr = ref_audio
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+    audio = audio.to(device)
+
+    return audio, rms
+
+
+# combine generated waves of consecutive chunks with cross-fading
+
+
+@functools.lru_cache(maxsize=16)
+def get_fade_curves(cross_fade_samples, curve="linear"):
+    t = np.linspace(0, 1, cross_fade_samples, dtype=np.float32)
+    if curve == "linear":
+        fade_out, fade_in = 1 - t, t
+    elif curve == "equal_power":  # constant power for uncorrelated signals, no dip in loudness mid-fade
+        fade_out, fade_in = np.cos(t * np.pi / 2), np.sin(t * np.pi / 2)
+    else:
+        raise ValueError(f"Unknown cross-fade curve: {curve}")
+    fade_out.setflags(write=False)
+    fade_in.setflags(write=False)
+    return fade_out, fade_in
+
+
+class CrossFadeAssembler:
+    # each wave fades in over the last cross_fade_duration of what came before (less if either is shorter)
+    # assemble() writes all waves into one buffer of the final length, push() & flush() do it incrementally
+    # for streaming, returning what is final so far and holding back the tail the next wave fades into
+
+    def __init__(self, cross_fade_duration=cross_fade_duration, curve="linear", sample_rate=target_sample_rate):
+        self.cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+        self.curve = curve
+        self.tail = None
+
+    def overlap(self, prev_len, next_len):
+        return min(self.cross_fade_samples, prev_len, next_len)
+
+    def write(self, out, pos, wave, overlap_samples):
+        # out[:pos] holds what came before, wave is faded into its last overlap_samples, returns the new end
+        if overlap_samples > 0:
+            fade_out, fade_in = get_fade_curves(overlap_samples, self.curve)
+            out[pos - overlap_samples : pos] *= fade_out
+            out[pos - overlap_samples : pos] += wave[:overlap_samples] * fade_in
+        out[pos : pos + len(wave) - overlap_samples] = wave[overlap_samples:]
+        return pos + len(wave) - overlap_samples
+
+    def assemble(self, waves):
+        overlaps = [0]
+        total_len = len(waves[0])
+        for wave in waves[1:]:
+            overlaps.append(self.overlap(total_len, len(wave)))
+            total_len += len(wave) - overlaps[-1]
+
+        out = np.empty(total_len, dtype=np.float32)
+        pos = 0
+        for wave, overlap_samples in zip(waves, overlaps):
+            pos = self.write(out, pos, wave, overlap_samples)
+        return out
+
+    def push(self, wave):
+        if self.tail is None:
+            joined = np.asarray(wave, dtype=np.float32)
+        else:
+            overlap_samples = self.overlap(len(self.tail), len(wave))
+            joined = np.empty(len(self.tail) + len(wave) - overlap_samples, dtype=np.float32)
+            joined[: len(self.tail)] = self.tail
+            self.write(joined, len(self.tail), wave, overlap_samples)
+
+        final_len = max(len(joined) - self.cross_fade_samples, 0)
+        self.tail = joined[final_len:]
+        return joined[:final_len]
+
+    def flush(self):
+        tail, self.tail = self.tail, None
+        return tail if tail is not None else np.zeros(0, dtype=np.float32)
+
+
+def cross_fade_waves(generated_waves, cross_fade_duration=cross_fade_duration, curve="linear"):
+    return CrossFadeAssembler(cross_fade_duration, curve).assemble(generated_waves)
+
+
+# incremental cross_fade_waves(), yields the combined wave piece by piece as waves come in
+
+
+def cross_fade_waves_stream(generated_waves, cross_fade_duration=cross_fade_duration, curve="linear"):
+    assembler = CrossFadeAssembler(cross_fade_duration, curve)
+    for generated_wave in generated_waves:
+        wave = assembler.push(generated_wave)
+        if len(wave) > 0:
+            yield wave
+    wave = assembler.flush()
+    if len(wave) > 0:
+        yield wave
+
+
+# Split the input text into batches, sized by the speaking rate of the reference
+
+
+def split_gen_text(ref_audio, ref_text, gen_text, show_info=print, first_chars=None, per_sentence=False):
+    audio, sr = torchaudio.load(ref_audio)
+    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    gen_text_batches = chunk_text(gen_text, max_chars=max_chars, first_chars=first_chars, per_sentence=per_sentence)
+    for i, gen_text in enumerate(gen_text_batches):
+        print(f"gen_text {i}", gen_text)
+
+    show_info(f"Generating audio in {len(gen_text_batches)} batches...")
+    return audio, sr, gen_text_batches
+
+
 # infer process: chunk text -> infer batches [i.e. infer_batch_process()]
 
 
@@ -357,22 +994,26 @@ def infer_process(
     progress=tqdm,
     target_rms=target_rms,
     cross_fade_duration=cross_fade_duration,
+    cross_fade_curve=cross_fade_curve,
     nfe_step=nfe_step,
     cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
     sway_sampling_coef=sway_sampling_coef,
     speed=speed,
     fix_duration=fix_duration,
-    device=device,
-    indic = False
+    device=None,
+    indic = False,
+    batch_chunks=False,
+    seed=None,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
 ):
-    # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
-    max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
-    gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
-    for i, gen_text in enumerate(gen_text_batches):
-        print(f"gen_text {i}", gen_text)
-
-    show_info(f"Generating audio in {len(gen_text_batches)} batches...")
+    # with the output cache and an explicit seed, chunks of single sentences, to be reused by other texts
+    per_sentence = output_cache is not None and seed is not None and hasattr(model_obj, "ckpt_id")
+    audio, sr, gen_text_batches = split_gen_text(
+        ref_audio, ref_text, gen_text, show_info=show_info, per_sentence=per_sentence
+    )
     return infer_batch_process(
         (audio, sr),
         ref_text,
@@ -383,13 +1024,78 @@ def infer_process(
         progress=progress,
         target_rms=target_rms,
         cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
         nfe_step=nfe_step,
         cfg_strength=cfg_strength,
+        cfg_schedule=cfg_schedule,
+        block_cache=block_cache,
         sway_sampling_coef=sway_sampling_coef,
         speed=speed,
         fix_duration=fix_duration,
         device=device,
-        indic = indic
+        indic = indic,
+        batch_chunks=batch_chunks,
+        seed=seed,
+        vocoder_max_frames=vocoder_max_frames,
+        vocoder_num_workers=vocoder_num_workers,
+    )
+
+
+# streaming infer process: chunk text -> yield audio as each batch is vocoded [i.e. infer_batch_process_stream()]
+
+
+def infer_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    show_info=print,
+    progress=tqdm,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    cross_fade_curve=cross_fade_curve,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    device=None,
+    indic=False,
+    first_chunk_chars=first_chunk_chars,
+    first_nfe_step=first_nfe_step,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+):
+    audio, sr, gen_text_batches = split_gen_text(
+        ref_audio, ref_text, gen_text, show_info=show_info, first_chars=first_chunk_chars
+    )
+    return infer_batch_process_stream(
+        (audio, sr),
+        ref_text,
+        gen_text_batches,
+        model_obj,
+        vocoder,
+        mel_spec_type=mel_spec_type,
+        progress=progress,
+        target_rms=target_rms,
+        cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        cfg_schedule=cfg_schedule,
+        block_cache=block_cache,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        fix_duration=fix_duration,
+        device=device,
+        indic=indic,
+        first_nfe_step=first_nfe_step,
+        vocoder_max_frames=vocoder_max_frames,
+        vocoder_num_workers=vocoder_num_workers,
     )
 
 
@@ -406,137 +1112,494 @@ def infer_batch_process(
     progress=tqdm,
     target_rms=0.1,
     cross_fade_duration=0.15,
-    nfe_step=32,
+    cross_fade_curve="linear",
+    nfe_step=None,
     cfg_strength=2.0,
+    cfg_schedule=None,
+    block_cache=None,
     sway_sampling_coef=-1,
     speed=1,
     fix_duration=None,
     device=None,
-    indic = False
+    indic = False,
+    batch_chunks=False,
+    max_batch_frames=max_batch_frames,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+    seed=None,
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
+    prompt = get_ref_prompt(ref_audio, ref_text, model_obj, target_rms=target_rms, device=device, indic=indic)
+
+    # with the output cache, repeated chunks are read back and only new ones generated, each sampled with the seed,
+    # so that its audio does not depend on the chunks generated along with it
+    cache = output_cache if seed is not None and hasattr(model_obj, "ckpt_id") else None
+    results = {}  # chunk index -> (wave, mel)
+    if cache is not None:
+        keys = [
+            get_output_key(
+                prompt,
+                gen_text,
+                model_obj,
+                mel_spec_type=mel_spec_type,
+                target_rms=target_rms,
+                nfe_step=nfe_step,
+                cfg_strength=cfg_strength,
+                cfg_schedule=cfg_schedule,
+                block_cache=block_cache,
+                sway_sampling_coef=sway_sampling_coef,
+                speed=speed,
+                fix_duration=fix_duration,
+                indic=indic,
+                seed=seed,
+                batch_chunks=batch_chunks,  # padding in batches changes the audio a little
+            )
+            for gen_text in gen_text_batches
+        ]
+        for i, key in enumerate(keys):
+            wave = cache.get(key)
+            if wave is not None:  # mel of the cached audio, for the spectrogram
+                with torch.inference_mode():
+                    mel = model_obj.mel_spec(torch.from_numpy(wave).to(prompt.mel.device).unsqueeze(0))
+                results[i] = (wave, mel[0].cpu().numpy())
+        if results:
+            print(f"{len(results)} of {len(gen_text_batches)} batches from output cache")
+    todo = [i for i in range(len(gen_text_batches)) if i not in results]
+
+    if batch_chunks and todo:  # all chunks share the reference, so sample them together in frame-budgeted batches
+        chunks = [
+            (0, i, gen_text_batches[i], get_duration(prompt, gen_text_batches[i], speed, fix_duration)) for i in todo
+        ]
+        results.update(
+            infer_chunk_batches(
+                [prompt],
+                chunks,
+                model_obj,
+                vocoder,
+                mel_spec_type=mel_spec_type,
+                progress=progress,
+                target_rms=target_rms,
+                nfe_step=nfe_step,
+                cfg_strength=cfg_strength,
+                cfg_schedule=cfg_schedule,
+                block_cache=block_cache,
+                sway_sampling_coef=sway_sampling_coef,
+                max_batch_frames=max_batch_frames,
+                vocoder_max_frames=vocoder_max_frames,
+                vocoder_num_workers=vocoder_num_workers,
+                device=device,
+                indic=indic,
+                seed=seed if cache is not None else None,
+            )[0]
+        )
+    elif todo:
+        generated = infer_chunks(
+            prompt,
+            [gen_text_batches[i] for i in todo],
+            model_obj,
+            vocoder,
+            mel_spec_type=mel_spec_type,
+            progress=progress,
+            target_rms=target_rms,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            cfg_schedule=cfg_schedule,
+            block_cache=block_cache,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            indic=indic,
+            vocoder_max_frames=vocoder_max_frames,
+            vocoder_num_workers=vocoder_num_workers,
+            seed=seed if cache is not None else None,
+        )
+        results.update(zip(todo, generated))
 
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    if cache is not None:
+        for i in todo:
+            cache.put(keys[i], results[i][0])
 
-    generated_waves = []
-    spectrograms = []
+    generated_waves, spectrograms = zip(*[results[i] for i in range(len(gen_text_batches))])
 
-    if len(ref_text[-1].encode("utf-8")) == 1:
-        ref_text = ref_text + " "
-    for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
-        # Prepare the text
-        text_list = [ref_text + gen_text]
-        if not indic:
-            final_text_list = convert_char_to_pinyin(text_list)
-        else:
-            final_text_list = list(text_list)
+    # Combine all generated waves with cross-fading
+    final_wave = cross_fade_waves(list(generated_waves), cross_fade_duration, cross_fade_curve)
 
-        ref_audio_len = audio.shape[-1] // hop_length
-        if fix_duration is not None:
-            duration = int(fix_duration * target_sample_rate / hop_length)
-        else:
-            # Calculate duration
-            ref_text_len = len(ref_text.encode("utf-8"))
-            gen_text_len = len(gen_text.encode("utf-8"))
-            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
+    # Create a combined spectrogram
+    combined_spectrogram = np.concatenate(spectrograms, axis=1)
+
+    return final_wave, target_sample_rate, combined_spectrogram
+
+
+# infer chunks one by one with a shared reference prompt, yields (wave, mel) of each chunk once vocoded
+# first_nfe_step, if given, for the first chunk only. with pipeline, a chunk is vocoded on a worker thread
+# while the next one is sampled on another, results still in order
+
+
+def infer_chunks(
+    prompt,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    progress=tqdm,
+    target_rms=target_rms,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    indic=False,
+    first_nfe_step=None,
+    pipeline=pipeline_vocoder,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+    seed=None,
+):
+    def sample_chunk(i, gen_text):
+        # Prepare the text, reference part already tokenized in prompt
+        final_text_list = get_prompt_text_list([prompt], [gen_text], indic)
+
+        duration = get_duration(prompt, gen_text, speed, fix_duration)
 
         # inference
         with torch.inference_mode():
             generated, _ = model_obj.sample(
-                cond=audio,
+                cond=prompt,
                 text=final_text_list,
                 duration=duration,
-                steps=nfe_step,
+                steps=first_nfe_step if i == 0 and first_nfe_step is not None else nfe_step,
                 cfg_strength=cfg_strength,
+                cfg_schedule=cfg_schedule,
+                block_cache=block_cache,
                 sway_sampling_coef=sway_sampling_coef,
+                seed=seed,
             )
 
             generated = generated.to(torch.float32)
-            generated = generated[:, ref_audio_len:, :]
-            generated_mel_spec = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated_mel_spec)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated_mel_spec)
-            if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
+            generated = generated[:, prompt.audio_len :, :]
+            return generated.permute(0, 2, 1)
+
+    def decode_chunk(generated_mel_spec):
+        with torch.inference_mode():
+            generated_wave = decode_mel(
+                vocoder, generated_mel_spec, mel_spec_type, vocoder_max_frames, num_workers=vocoder_num_workers
+            )
+            if prompt.rms < target_rms:
+                generated_wave = generated_wave * prompt.rms / target_rms
 
             # wav -> numpy
             generated_wave = generated_wave.squeeze().cpu().numpy()
 
-            generated_waves.append(generated_wave)
-            spectrograms.append(generated_mel_spec[0].cpu().numpy())
+        return generated_wave, generated_mel_spec[0].cpu().numpy()
+
+    if not pipeline:
+        for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
+            yield decode_chunk(sample_chunk(i, gen_text))
+        return
+
+    def sample_then_decode(i, gen_text):
+        return decoder.submit(decode_chunk, sample_chunk(i, gen_text))
+
+    sampler = ThreadPoolExecutor(max_workers=1)
+    decoder = ThreadPoolExecutor(max_workers=1)
+    try:
+        futures = [sampler.submit(sample_then_decode, i, gen_text) for i, gen_text in enumerate(gen_text_batches)]
+        for future in progress.tqdm(futures):
+            yield future.result().result()
+    finally:  # also when the consumer stops early, drop chunks not started yet
+        sampler.shutdown(cancel_futures=True)
+        decoder.shutdown(cancel_futures=True)
+
+
+# streaming infer batches: yields the cross-faded audio (float32) of each batch as soon as it is vocoded,
+# holding back the tail the next batch fades into
+
+
+def infer_batch_process_stream(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    progress=tqdm,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    cross_fade_curve=cross_fade_curve,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    device=None,
+    indic=False,
+    first_nfe_step=first_nfe_step,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+):
+    prompt = get_ref_prompt(ref_audio, ref_text, model_obj, target_rms=target_rms, device=device, indic=indic)
+    generated_waves = (
+        generated_wave
+        for generated_wave, _ in infer_chunks(
+            prompt,
+            gen_text_batches,
+            model_obj,
+            vocoder,
+            mel_spec_type=mel_spec_type,
+            progress=progress,
+            target_rms=target_rms,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            cfg_schedule=cfg_schedule,
+            block_cache=block_cache,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            fix_duration=fix_duration,
+            indic=indic,
+            first_nfe_step=first_nfe_step,
+            vocoder_max_frames=vocoder_max_frames,
+            vocoder_num_workers=vocoder_num_workers,
+        )
+    )
+    yield from cross_fade_waves_stream(generated_waves, cross_fade_duration, cross_fade_curve)
 
-    # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
-    else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
 
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
+# reference prompt: mel frames, token ids, rms and length of the reference, prepared once for all its chunks
 
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
 
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
+def get_ref_prompt(ref_audio, ref_text, model_obj, target_rms=target_rms, device=None, indic=False):
+    device = device or get_default_device()
+    # mel of a returning voice from voice_cache, keyed by the audio and the mel settings of the model
+    mel_spec = model_obj.mel_spec
+    audio, sr = ref_audio
+    mel_key = voice_cache.key(
+        audio.cpu().numpy().tobytes(),
+        f"{sr}_{target_rms}_{mel_spec.extractor.__name__}_{mel_spec.target_sample_rate}",
+        f"{mel_spec.n_fft}_{mel_spec.hop_length}_{mel_spec.win_length}_{mel_spec.n_mel_channels}",
+    )
+    ref_mel = voice_cache.get(mel_key)
+    if ref_mel is None:
+        audio, rms = prepare_ref_audio(ref_audio, target_rms=target_rms, device=device)
+        with torch.no_grad():
+            mel = mel_spec(audio).permute(0, 2, 1)[0]  # 1 d n -> n d
+        ref_mel = dict(mel=mel, rms=rms.item(), audio_len=audio.shape[-1] // hop_length)
+        voice_cache.put(mel_key, ref_mel)
 
-            # Combine
-            new_wave = np.concatenate(
-                [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
+    if len(ref_text[-1].encode("utf-8")) == 1:
+        ref_text = ref_text + " "
+    # the tail, at most up to the last punctuation or space, is converted along with each generated text instead
+    ref_head, ref_tail = (ref_text, "") if indic else split_ref_text(ref_text)
+    ref_tokens = ref_head if indic else convert_char_to_pinyin([ref_head])[0]
+    text_ids = model_obj.tokenize([ref_tokens])[0]
+
+    return RefPrompt(
+        mel=ref_mel["mel"].to(device),
+        text_ids=text_ids,
+        text=ref_text,
+        rms=ref_mel["rms"],
+        audio_len=ref_mel["audio_len"],
+        text_tail=ref_tail,
+    )
+
+
+# text of each chunk to sample after its prompt, the same tokens as converting reference & generated text at once
+
+
+def get_prompt_text_list(prompts, gen_texts, indic=False):
+    text_list = [prompt.text_tail + gen_text for prompt, gen_text in zip(prompts, gen_texts)]
+    return text_list if indic else convert_char_to_pinyin(text_list)
+
+
+# total frames of a chunk, reference included, from the speaking rate of the reference
+
+
+def get_duration(prompt, gen_text, speed=speed, fix_duration=fix_duration):
+    if fix_duration is not None:
+        return int(fix_duration * target_sample_rate / hop_length)
+
+    ref_text_len = len(prompt.text.encode("utf-8"))
+    gen_text_len = len(gen_text.encode("utf-8"))
+    return prompt.audio_len + int(prompt.audio_len / ref_text_len * gen_text_len / speed)
+
+
+# sample & vocode chunks in batches: bucket chunks by frames -> one sample call & one vocoder call per bucket
+# chunks as (prompt_idx, chunk_idx, gen_text, duration), returns per prompt a dict of chunk_idx -> (wave, mel)
+
+
+def infer_chunk_batches(
+    prompts,
+    chunks,
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    progress=tqdm,
+    target_rms=target_rms,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
+    sway_sampling_coef=sway_sampling_coef,
+    max_batch_frames=max_batch_frames,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+    device=None,
+    indic=False,
+    seed=None,
+):
+    device = device or get_default_device()
+
+    # bucket by total frames, longest first, so the padding within a batch stays small
+    chunks = sorted(chunks, key=lambda chunk: chunk[-1], reverse=True)
+    batches = []
+    for chunk in chunks:
+        if batches and (len(batches[-1]) + 1) * batches[-1][0][-1] <= max_batch_frames:
+            batches[-1].append(chunk)
+        else:
+            batches.append([chunk])
+
+    results = [dict() for _ in prompts]
+    for batch in progress.tqdm(batches):
+        prompt_idxs, chunk_idxs, text_list, durations = zip(*batch)
+        batch_prompts = [prompts[prompt_idx] for prompt_idx in prompt_idxs]
+        final_text_list = get_prompt_text_list(batch_prompts, text_list, indic)
+
+        # inference
+        with torch.inference_mode():
+            generated, _ = model_obj.sample(
+                cond=batch_prompts,
+                text=final_text_list,
+                duration=torch.tensor(durations, dtype=torch.long, device=device),
+                steps=nfe_step,
+                cfg_strength=cfg_strength,
+                cfg_schedule=cfg_schedule,
+                block_cache=block_cache,
+                sway_sampling_coef=sway_sampling_coef,
+                seed=seed,  # noise seeded per chunk, same as sampled alone
             )
+            generated = generated.to(torch.float32)
 
-            final_wave = new_wave
+            # same as in sample(), duration is at least the reference or text length plus one
+            durations = [
+                min(max(duration, max(len(prompt.text_ids) + len(text), prompt.mel.shape[0]) + 1), 4096)
+                for duration, prompt, text in zip(durations, batch_prompts, final_text_list)
+            ]
 
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
+            # vocode the batch at once, each mel padded with silent frames (log of mel clip value) after its end
+            gen_lens = [duration - prompt.audio_len for duration, prompt in zip(durations, batch_prompts)]
+            generated_mel_spec = torch.full(
+                (len(batch), max(gen_lens), generated.shape[-1]), math.log(1e-5), device=generated.device
+            )
+            for i, (prompt, duration) in enumerate(zip(batch_prompts, durations)):
+                generated_mel_spec[i, : duration - prompt.audio_len] = generated[i, prompt.audio_len : duration]
+            generated_mel_spec = generated_mel_spec.permute(0, 2, 1)
+            generated_wave = decode_mel(
+                vocoder, generated_mel_spec, mel_spec_type, vocoder_max_frames, num_workers=vocoder_num_workers
+            )
 
-    return final_wave, target_sample_rate, combined_spectrogram
+            for i, (prompt_idx, chunk_idx, gen_len) in enumerate(zip(prompt_idxs, chunk_idxs, gen_lens)):
+                wave = generated_wave[i, : gen_len * hop_length]
+                rms = prompts[prompt_idx].rms
+                if rms < target_rms:
+                    wave = wave * rms / target_rms
+
+                # wav -> numpy
+                results[prompt_idx][chunk_idx] = (wave.cpu().numpy(), generated_mel_spec[i, :, :gen_len].cpu().numpy())
+
+    return results
+
+
+# batched inference of several requests: chunk texts -> bucket chunks of all requests by frames [i.e. infer_chunk_batches()]
+
+
+def infer_batch_requests(
+    requests,  # list of (ref_audio, ref_text, gen_text), ref_audio & ref_text as from preprocess_ref_audio_text()
+    model_obj,
+    vocoder,
+    mel_spec_type=mel_spec_type,
+    progress=tqdm,
+    target_rms=target_rms,
+    cross_fade_duration=cross_fade_duration,
+    cross_fade_curve=cross_fade_curve,
+    nfe_step=nfe_step,
+    cfg_strength=cfg_strength,
+    cfg_schedule=cfg_schedule,
+    block_cache=block_cache,
+    sway_sampling_coef=sway_sampling_coef,
+    speed=speed,
+    fix_duration=fix_duration,
+    max_batch_frames=max_batch_frames,
+    vocoder_max_frames=vocoder_max_frames,
+    vocoder_num_workers=vocoder_num_workers,
+    device=None,
+    indic=False,
+):
+    # chunks of all requests, each with the prompt of its request and target length in frames
+    prompts = []
+    chunks = []
+    for request_idx, (ref_audio, ref_text, gen_text) in enumerate(requests):
+        audio, sr = torchaudio.load(ref_audio)
+        max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+        prompt = get_ref_prompt((audio, sr), ref_text, model_obj, target_rms=target_rms, device=device, indic=indic)
+        prompts.append(prompt)
+
+        for chunk_idx, gen_text_chunk in enumerate(chunk_text(gen_text, max_chars=max_chars)):
+            duration = get_duration(prompt, gen_text_chunk, speed, fix_duration)
+            chunks.append((request_idx, chunk_idx, gen_text_chunk, duration))
+
+    results = infer_chunk_batches(
+        prompts,
+        chunks,
+        model_obj,
+        vocoder,
+        mel_spec_type=mel_spec_type,
+        progress=progress,
+        target_rms=target_rms,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        cfg_schedule=cfg_schedule,
+        block_cache=block_cache,
+        sway_sampling_coef=sway_sampling_coef,
+        max_batch_frames=max_batch_frames,
+        vocoder_max_frames=vocoder_max_frames,
+        vocoder_num_workers=vocoder_num_workers,
+        device=device,
+        indic=indic,
+    )
+
+    # Combine the chunks of each request with cross-fading
+    outputs = []
+    for result in results:
+        generated_waves, spectrograms = zip(*[result[chunk_idx] for chunk_idx in sorted(result)])
+        final_wave = cross_fade_waves(list(generated_waves), cross_fade_duration, cross_fade_curve)
+        outputs.append((final_wave, target_sample_rate, np.concatenate(spectrograms, axis=1)))
+
+    return outputs
 
 
 # remove silence from generated wav
 
 
 def remove_silence_for_generated_wav(filename):
-    aseg = AudioSegment.from_file(filename)
-    non_silent_segs = silence.split_on_silence(
-        aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
+    wave, sr = sf.read(filename, dtype="float32", always_2d=True)
+    non_silent_segs = split_on_silence(
+        wave.T, sr, min_silence_len=1000, silence_thresh=-50, keep_silence=500, seek_step=10
     )
-    non_silent_wave = AudioSegment.silent(duration=0)
-    for non_silent_seg in non_silent_segs:
-        non_silent_wave += non_silent_seg
-    aseg = non_silent_wave
-    aseg.export(filename, format="wav")
+    non_silent_wave = np.concatenate([wave.T[:, :0]] + non_silent_segs, axis=-1)
+    sf.write(filename, non_silent_wave.T, sr, subtype="PCM_16")
 
 
 # save spectrogram
 
 
 def save_spectrogram(spectrogram, path):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pylab as plt
+
     plt.figure(figsize=(12, 4))
     plt.imshow(spectrogram, origin="lower", aspect="auto")
     plt.colorbar()
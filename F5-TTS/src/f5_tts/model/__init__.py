@@ -4,7 +4,14 @@ from f5_tts.model.backbones.unett import UNetT
 from f5_tts.model.backbones.dit import DiT
 from f5_tts.model.backbones.mmdit import MMDiT
 
-from f5_tts.model.trainer import Trainer
+
+# the trainer pulls in wandb, accelerate & datasets, imported on first access so inference starts faster
+def __getattr__(name):
+    if name == "Trainer":
+        from f5_tts.model.trainer import Trainer
+
+        return Trainer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 __all__ = ["CFM", "UNetT", "DiT", "MMDiT", "Trainer"]
@@ -24,6 +24,7 @@ from f5_tts.model.modules import (
     precompute_freqs_cis,
     get_pos_embed_indices,
 )
+from f5_tts.model.utils import default
 
 
 # Text embedding
@@ -44,7 +45,7 @@ class TextEmbedding(nn.Module):
         else:
             self.extra_modeling = False
 
-    def forward(self, text: int["b nt"], seq_len, drop_text=False):  # noqa: F722
+    def forward(self, text: int["b nt"], seq_len, drop_text=False, mask: bool["b n"] | None = None):  # noqa: F722
         text = text + 1  # use 0 as filler token. preprocess of batch pad -1, see list_str_to_idx()
         text = text[:, :seq_len]  # curtail if character tokens are more than the mel spec tokens
         batch, text_len = text.shape[0], text.shape[1]
@@ -64,7 +65,8 @@ class TextEmbedding(nn.Module):
             text = text + text_pos_embed
 
             # convnextv2 blocks
-            text = self.text_blocks(text)
+            for block in self.text_blocks:
+                text = block(text, mask=mask)
 
         return text
 
@@ -75,16 +77,79 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        text_embed: float["b n d"],  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant part already projected, see embed_cond()
+            x = F.linear(x, self.proj.weight[:, : self.mel_dim]) + cond_embed
+        else:
+            if drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
+
+        x = self.conv_pos_embed(x, mask=mask) + x  # padding of a batch zeroed as if at sequence end
+        return x
+
+    def embed_cond(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # proj is linear in [x, cond, text_embed], so the cond & text part (with bias) is fixed along the ode
         if drop_audio_cond:  # cfg for cond audio
             cond = torch.zeros_like(cond)
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
-        x = self.conv_pos_embed(x) + x
-        return x
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, self.mel_dim :], self.proj.bias)
+
+
+# cross-step cache of the middle dit blocks, DeepCache-style
+
+
+class BlockCache:
+    def __init__(self, start, end, interval=3, threshold=None):
+        # blocks [start, end) are run on refresh, and on other steps their residual contribution is reused
+        # refresh every `interval` forwards, or earlier once their input drifted by more than `threshold`
+        # (relative mean abs change since last refresh). one cache per sampling branch, state lives for one call
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.threshold = threshold
+
+        self.residual = None
+        self.ref_input = None
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+
+    def needs_refresh(self, x: float["b n d"]):  # noqa: F722
+        if self.residual is None or self.residual.shape != x.shape:
+            return True
+        if self.age + 1 >= self.interval:
+            return True
+        if self.threshold is not None:
+            change = (x - self.ref_input).abs().mean() / self.ref_input.abs().mean()
+            return change.item() > self.threshold
+        return False
+
+    def __call__(self, x: float["b n d"], blocks_fn):  # noqa: F722
+        if self.needs_refresh(x):
+            out = blocks_fn(x)
+            self.residual = out - x
+            self.ref_input = x
+            self.age = 0
+            self.misses += 1
+            return out
+
+        self.age += 1
+        self.hits += 1
+        return x + self.residual
 
 
 # Transformer backbone using DiT blocks
@@ -127,6 +192,33 @@ class DiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_cond_embed(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio
+        drop_text=False,  # cfg for text
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        # text embedding and its input projection only depend on cond & text, compute once per sampling
+        text_embed = self.text_embed(text, cond.shape[1], drop_text=drop_text, mask=mask)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+    def get_time_cond(self, time: float["s"]):  # noqa: F821
+        # time embedding and every adaln modulation for a whole time schedule, one matmul per norm layer
+        # returns per step (t, t_mods), each with batch 1 to broadcast over the batch
+        t = self.time_embed(time)
+        norms = [block.attn_norm for block in self.transformer_blocks] + [self.norm_out]
+        mods = [norm.get_mod(t) for norm in norms]
+        return [(t[i : i + 1], [mod[i : i + 1] for mod in mods]) for i in range(time.shape[0])]
+
+    def get_block_cache(self, interval=3, threshold=None, start=None, end=None):
+        # by default keep the shallow and deep quarters exact, cache the middle half of the blocks
+        start = default(start, self.depth // 4)
+        end = default(end, self.depth - self.depth // 4)
+        assert 0 <= start < end <= self.depth, f"invalid cached block range [{start}, {end}) for depth {self.depth}"
+        return BlockCache(start, end, interval=interval, threshold=threshold)
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
@@ -136,28 +228,46 @@ class DiT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
+        cond_embed: float["b n d"] | None = None,  # precomputed get_cond_embed(), step-invariant  # noqa: F722
+        time_cond=None,  # precomputed get_time_cond() of this step
+        block_cache: BlockCache | None = None,  # get_block_cache(), reused across steps of one sampling
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+        if time_cond is not None:
+            t, t_mods = time_cond
+        else:
+            t, t_mods = self.time_embed(time), [None] * (self.depth + 1)
+        if cond_embed is not None:
+            x = self.input_embed(x, cond, None, cond_embed=cond_embed, mask=mask)
+        else:
+            text_embed = self.text_embed(text, seq_len, drop_text=drop_text, mask=mask)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond, mask=mask)
 
         rope = self.rotary_embed.forward_from_seq_len(seq_len)
 
         if self.long_skip_connection is not None:
             residual = x
 
-        for block in self.transformer_blocks:
-            x = block(x, t, mask=mask, rope=rope)
+        def run_blocks(x, start=0, end=self.depth):
+            for block, t_mod in zip(self.transformer_blocks[start:end], t_mods[start:end]):
+                x = block(x, t, mask=mask, rope=rope, t_mod=t_mod)
+            return x
+
+        if block_cache is not None:
+            x = run_blocks(x, end=block_cache.start)
+            x = block_cache(x, lambda x: run_blocks(x, block_cache.start, block_cache.end))
+            x = run_blocks(x, start=block_cache.end)
+        else:
+            x = run_blocks(x)
 
         if self.long_skip_connection is not None:
             x = self.long_skip_connection(torch.cat((x, residual), dim=-1))
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, mod=t_mods[-1])
         output = self.proj_out(x)
 
         return output
@@ -11,6 +11,7 @@ from __future__ import annotations
 
 import torch
 from torch import nn
+import torch.nn.functional as F
 
 from x_transformers.x_transformers import RotaryEmbedding
 
@@ -58,16 +59,33 @@ class TextEmbedding(nn.Module):
 class AudioEmbedding(nn.Module):
     def __init__(self, in_dim, out_dim):
         super().__init__()
+        self.in_dim = in_dim
         self.linear = nn.Linear(2 * in_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], drop_audio_cond=False):  # noqa: F722
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant part already projected, see embed_cond()
+            x = F.linear(x, self.linear.weight[:, : self.in_dim]) + cond_embed
+        else:
+            if drop_audio_cond:
+                cond = torch.zeros_like(cond)
+            x = torch.cat((x, cond), dim=-1)
+            x = self.linear(x)
+        x = self.conv_pos_embed(x, mask=mask) + x  # padding of a batch zeroed as if at sequence end
+        return x
+
+    def embed_cond(self, cond: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # linear is linear in [x, cond], so the cond part (with bias) is fixed along the ode
         if drop_audio_cond:
             cond = torch.zeros_like(cond)
-        x = torch.cat((x, cond), dim=-1)
-        x = self.linear(x)
-        x = self.conv_pos_embed(x) + x
-        return x
+        return F.linear(cond, self.linear.weight[:, self.in_dim :], self.linear.bias)
 
 
 # Transformer backbone using MM-DiT blocks
@@ -113,6 +131,30 @@ class MMDiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_cond_embed(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio
+        drop_text=False,  # cfg for text
+        mask: bool["b n"] | None = None,  # unused, text context is not aligned with audio frames  # noqa: F722
+    ):
+        # text context and cond audio projection only depend on cond & text, compute once per sampling
+        c = self.text_embed(text, drop_text=drop_text)
+        return c, self.audio_embed.embed_cond(cond, drop_audio_cond=drop_audio_cond)
+
+    def get_time_cond(self, time: float["s"]):  # noqa: F821
+        # time embedding and every adaln modulation for a whole time schedule, one matmul per norm layer
+        # returns per step (t, t_mods), each with batch 1 to broadcast over the batch
+        t = self.time_embed(time)
+        mods = [(block.attn_norm_c.get_mod(t), block.attn_norm_x.get_mod(t)) for block in self.transformer_blocks]
+        mods.append(self.norm_out.get_mod(t))
+        steps = []
+        for i in range(time.shape[0]):
+            t_mods = [(c_mod[i : i + 1], x_mod[i : i + 1]) for c_mod, x_mod in mods[:-1]]
+            steps.append((t[i : i + 1], t_mods + [mods[-1][i : i + 1]]))
+        return steps
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
@@ -122,25 +164,34 @@ class MMDiT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
+        cond_embed: tuple[float["b nt d"], float["b n d"]] | None = None,  # precomputed get_cond_embed()  # noqa: F722
+        time_cond=None,  # precomputed get_time_cond() of this step
     ):
         batch = x.shape[0]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning (time), c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        c = self.text_embed(text, drop_text=drop_text)
-        x = self.audio_embed(x, cond, drop_audio_cond=drop_audio_cond)
+        if time_cond is not None:
+            t, t_mods = time_cond
+        else:
+            t, t_mods = self.time_embed(time), [None] * (self.depth + 1)
+        if cond_embed is not None:
+            c, audio_cond_embed = cond_embed
+            x = self.audio_embed(x, cond, cond_embed=audio_cond_embed, mask=mask)
+        else:
+            c = self.text_embed(text, drop_text=drop_text)
+            x = self.audio_embed(x, cond, drop_audio_cond=drop_audio_cond, mask=mask)
 
         seq_len = x.shape[1]
-        text_len = text.shape[1]
+        text_len = c.shape[1]
         rope_audio = self.rotary_embed.forward_from_seq_len(seq_len)
         rope_text = self.rotary_embed.forward_from_seq_len(text_len)
 
-        for block in self.transformer_blocks:
-            c, x = block(x, c, t, mask=mask, rope=rope_audio, c_rope=rope_text)
+        for block, t_mod in zip(self.transformer_blocks, t_mods):
+            c, x = block(x, c, t, mask=mask, rope=rope_audio, c_rope=rope_text, t_mod=t_mod)
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, mod=t_mods[-1])
         output = self.proj_out(x)
 
         return output
@@ -47,7 +47,7 @@ class TextEmbedding(nn.Module):
         else:
             self.extra_modeling = False
 
-    def forward(self, text: int["b nt"], seq_len, drop_text=False):  # noqa: F722
+    def forward(self, text: int["b nt"], seq_len, drop_text=False, mask: bool["b n"] | None = None):  # noqa: F722
         text = text + 1  # use 0 as filler token. preprocess of batch pad -1, see list_str_to_idx()
         text = text[:, :seq_len]  # curtail if character tokens are more than the mel spec tokens
         batch, text_len = text.shape[0], text.shape[1]
@@ -67,7 +67,8 @@ class TextEmbedding(nn.Module):
             text = text + text_pos_embed
 
             # convnextv2 blocks
-            text = self.text_blocks(text)
+            for block in self.text_blocks:
+                text = block(text, mask=mask)
 
         return text
 
@@ -78,16 +79,36 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        text_embed: float["b n d"],  # noqa: F722
+        drop_audio_cond=False,
+        cond_embed: float["b n d"] | None = None,  # noqa: F722
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        if cond_embed is not None:  # step-invariant part already projected, see embed_cond()
+            x = F.linear(x, self.proj.weight[:, : self.mel_dim]) + cond_embed
+        else:
+            if drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
+
+        x = self.conv_pos_embed(x, mask=mask) + x  # padding of a batch zeroed as if at sequence end
+        return x
+
+    def embed_cond(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # proj is linear in [x, cond, text_embed], so the cond & text part (with bias) is fixed along the ode
         if drop_audio_cond:  # cfg for cond audio
             cond = torch.zeros_like(cond)
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
-        x = self.conv_pos_embed(x) + x
-        return x
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, self.mel_dim :], self.proj.bias)
 
 
 # Flat UNet Transformer backbone
@@ -161,6 +182,23 @@ class UNetT(nn.Module):
         self.norm_out = RMSNorm(dim)
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_cond_embed(
+        self,
+        cond: float["b n d"],  # masked cond audio  # noqa: F722
+        text: int["b nt"],  # text  # noqa: F722
+        drop_audio_cond=False,  # cfg for cond audio
+        drop_text=False,  # cfg for text
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        # text embedding and its input projection only depend on cond & text, compute once per sampling
+        text_embed = self.text_embed(text, cond.shape[1], drop_text=drop_text, mask=mask)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond=drop_audio_cond)
+
+    def get_time_cond(self, time: float["s"]):  # noqa: F821
+        # time embedding for a whole time schedule, returns per step with batch 1
+        t = self.time_embed(time)
+        return [t[i : i + 1] for i in range(time.shape[0])]
+
     def forward(
         self,
         x: float["b n d"],  # nosied input audio  # noqa: F722
@@ -170,15 +208,23 @@ class UNetT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,  # cfg for text
         mask: bool["b n"] | None = None,  # noqa: F722
+        cond_embed: float["b n d"] | None = None,  # precomputed get_cond_embed(), step-invariant  # noqa: F722
+        time_cond=None,  # precomputed get_time_cond() of this step
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
             time = time.repeat(batch)
 
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+        if time_cond is not None:
+            t = time_cond.expand(batch, -1)
+        else:
+            t = self.time_embed(time)
+        if cond_embed is not None:
+            x = self.input_embed(x, cond, None, cond_embed=cond_embed, mask=mask)
+        else:
+            text_embed = self.text_embed(text, seq_len, drop_text=drop_text, mask=mask)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond, mask=mask)
 
         # postfix time t to input x, [b n d] -> [b n+1 d]
         x = torch.cat([t.unsqueeze(1), x], dim=1)  # pack t to x
@@ -9,6 +9,7 @@ d - dimension
 
 from __future__ import annotations
 
+from collections import OrderedDict
 from random import random
 from typing import Callable
 
@@ -16,16 +17,20 @@ import torch
 import torch.nn.functional as F
 from torch import nn
 from torch.nn.utils.rnn import pad_sequence
-from torchdiffeq import odeint
 
 from f5_tts.model.modules import MelSpec
 from f5_tts.model.utils import (
+    RefPrompt,
     default,
     exists,
+    fixed_step_eval_times,
+    fixed_step_methods,
+    get_cfg_strength,
     lens_to_mask,
     list_str_to_idx,
     list_str_to_tensor,
     mask_from_frac_lengths,
+    odeint_fixed_step,
 )
 
 
@@ -37,7 +42,7 @@ class CFM(nn.Module):
         odeint_kwargs: dict = dict(
             # atol = 1e-5,
             # rtol = 1e-5,
-            method="euler"  # 'midpoint'
+            method="euler"  # 'midpoint' | 'heun', other methods fall back to torchdiffeq
         ),
         audio_drop_prob=0.3,
         cond_drop_prob=0.2,
@@ -46,6 +51,9 @@ class CFM(nn.Module):
         mel_spec_kwargs: dict = dict(),
         frac_lengths_mask: tuple[float, float] = (0.7, 1.0),
         vocab_char_map: dict[str:int] | None = None,
+        native_steps: int | None = None,
+        distilled_cfg_strength: float | None = None,
+        time_cond_cache_size: int = 2,  # time schedules kept, e.g. first chunk & rest of a stream, 0 to disable
     ):
         super().__init__()
 
@@ -74,20 +82,62 @@ class CFM(nn.Module):
         # vocab map for tokenization
         self.vocab_char_map = vocab_char_map
 
+        # number of ode steps a few-step distilled student is trained for, None for flow matching models
+        self.native_steps = native_steps
+
+        # cfg strength baked into a guidance-distilled model, which then samples without the null branch
+        self.distilled_cfg_strength = distilled_cfg_strength
+
+        # precomputed time conditioning per schedule, see get_time_cond_table()
+        # computed from the weights, so dropped whenever they change, see clear_time_cond_cache()
+        self.time_cond_cache = OrderedDict()
+        self.time_cond_cache_size = time_cond_cache_size
+
     @property
     def device(self):
         return next(self.parameters()).device
 
+    def tokenize(self, text: list[str] | list[list[str]]) -> int["b nt"]:  # noqa: F722
+        if exists(self.vocab_char_map):
+            return list_str_to_idx(text, self.vocab_char_map).to(self.device)
+        return list_str_to_tensor(text).to(self.device)
+
+    def get_time_cond_table(self, t: float["s"]):  # noqa: F821
+        # time embedding and adaln modulations only depend on t, so compute them for a whole schedule at once
+        key = (tuple(t.tolist()), t.dtype, t.device)
+        if key in self.time_cond_cache:
+            self.time_cond_cache.move_to_end(key)
+            return self.time_cond_cache[key]
+        table = dict(zip(key[0], self.transformer.get_time_cond(t)))
+        if self.time_cond_cache_size > 0:
+            self.time_cond_cache[key] = table
+            while len(self.time_cond_cache) > self.time_cond_cache_size:
+                self.time_cond_cache.popitem(last=False)
+        return table
+
+    def clear_time_cond_cache(self):
+        # to be called after any weight update done outside of load_state_dict(), e.g. an optimizer step
+        self.time_cond_cache.clear()
+
+    def load_state_dict(self, *args, **kwargs):
+        self.clear_time_cond_cache()
+        return super().load_state_dict(*args, **kwargs)
+
+    def _apply(self, *args, **kwargs):  # .to(), .half(), .cuda() etc., tables hold the old dtype & device
+        self.clear_time_cond_cache()
+        return super()._apply(*args, **kwargs)
+
     @torch.no_grad()
     def sample(
         self,
-        cond: float["b n d"] | float["b nw"],  # noqa: F722
-        text: int["b nt"] | list[str],  # noqa: F722
+        cond: float["b n d"] | float["b nw"] | RefPrompt | list[RefPrompt],  # noqa: F722
+        text: int["b nt"] | list[str],  # with prompt(s), the text after prompt.text_ids per item  # noqa: F722
         duration: int | int["b"],  # noqa: F821
         *,
         lens: int["b"] | None = None,  # noqa: F821
-        steps=32,
+        steps=None,  # None for native steps of a distilled model, otherwise 32
         cfg_strength=1.0,
+        cfg_schedule=None,  # see get_cfg_strength()
         sway_sampling_coef=None,
         seed: int | None = None,
         max_duration=4096,
@@ -96,8 +146,29 @@ class CFM(nn.Module):
         duplicate_test=False,
         t_inter=0.1,
         edit_mask=None,
+        batch_cfg=True,
+        block_cache: dict | None = None,  # e.g. dict(interval=3), see DiT.get_block_cache()
+        return_trajectory=False,
     ):
         self.eval()
+        steps = default(steps, default(self.native_steps, 32))
+        if exists(self.distilled_cfg_strength):  # guidance already in the single conditional pass
+            cfg_strength = 0.0
+
+        # reference prompt(s), mel and reference tokens prepared once, only generated text tokenized here
+
+        if isinstance(cond, (RefPrompt, list)):
+            prompts = [cond] * len(text) if isinstance(cond, RefPrompt) else cond
+            gen_text_ids = self.tokenize(text) if isinstance(text, list) else text
+            text = pad_sequence(
+                [torch.cat((prompt.text_ids, ids[ids != -1])) for prompt, ids in zip(prompts, gen_text_ids)],
+                padding_value=-1,
+                batch_first=True,
+            )
+            if not exists(lens):
+                lens = torch.tensor([prompt.mel.shape[0] for prompt in prompts], device=self.device)
+            cond = pad_sequence([prompt.mel for prompt in prompts], batch_first=True).to(self.device)
+
         # raw wave
 
         if cond.ndim == 2:
@@ -114,10 +185,7 @@ class CFM(nn.Module):
         # text
 
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            text = self.tokenize(text)
             assert text.shape[0] == batch
 
         if exists(text):
@@ -157,23 +225,88 @@ class CFM(nn.Module):
         if no_ref_audio:
             cond = torch.zeros_like(cond)
 
+        # pack cond & uncond inputs along batch for a single cfg forward: b ... -> 2b ...
+        # dropped audio cond is all zeros, dropped text is all filler tokens (-1 + 1 = 0), same as drop_* flags
+        batch_cfg = batch_cfg and cfg_strength >= 1e-5
+        if batch_cfg:
+            cfg_cond = torch.cat((step_cond, torch.zeros_like(step_cond)), dim=0)
+            cfg_text = torch.cat((text, torch.full_like(text, -1)), dim=0)
+            cfg_mask = torch.cat((mask, mask), dim=0) if exists(mask) else None
+
+        # at each step, conditioning is fixed, so embed text & cond audio once for the whole ode
+        cond_embed = self.transformer.get_cond_embed(step_cond, text, mask=mask)
+        if batch_cfg:
+            cfg_cond_embed = self.transformer.get_cond_embed(cfg_cond, cfg_text, mask=cfg_mask)
+        elif cfg_strength >= 1e-5:
+            null_cond_embed = self.transformer.get_cond_embed(
+                step_cond, text, drop_audio_cond=True, drop_text=True, mask=mask
+            )
+
+        # cross-step block caching (dit only), one cache per branch as cond & null hidden states differ
+        # caches are made per call, so nothing carries over between chunks or requests
+        if exists(block_cache):
+            assert hasattr(self.transformer, "get_block_cache"), "block_cache is only supported with DiT backbone"
+            branch_kwargs = {
+                branch: dict(block_cache=self.transformer.get_block_cache(**block_cache))
+                for branch in ("cfg", "cond", "null")
+            }
+        else:
+            branch_kwargs = dict(cfg={}, cond={}, null={})
+
         # neural ode
 
         def fn(t, x):
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
 
+            t_value = t.item()
+            time_cond = time_conds.get(t_value)
+            step_cfg_strength = get_cfg_strength(t_value, cfg_strength, cfg_schedule)
+
+            if batch_cfg and step_cfg_strength >= 1e-5:
+                pred, null_pred = self.transformer(
+                    x=torch.cat((x, x), dim=0),
+                    cond=cfg_cond,
+                    text=cfg_text,
+                    time=t,
+                    mask=cfg_mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cond_embed=cfg_cond_embed,
+                    time_cond=time_cond,
+                    **branch_kwargs["cfg"],
+                ).chunk(2, dim=0)
+                return pred + (pred - null_pred) * step_cfg_strength
+
             # predict flow
             pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=False, drop_text=False
+                x=x,
+                cond=step_cond,
+                text=text,
+                time=t,
+                mask=mask,
+                drop_audio_cond=False,
+                drop_text=False,
+                cond_embed=cond_embed,
+                time_cond=time_cond,
+                **branch_kwargs["cond"],
             )
-            if cfg_strength < 1e-5:
+            if step_cfg_strength < 1e-5:  # no guidance at this step, skip the null pass
                 return pred
 
             null_pred = self.transformer(
-                x=x, cond=step_cond, text=text, time=t, mask=mask, drop_audio_cond=True, drop_text=True
+                x=x,
+                cond=step_cond,
+                text=text,
+                time=t,
+                mask=mask,
+                drop_audio_cond=True,
+                drop_text=True,
+                cond_embed=null_cond_embed,
+                time_cond=time_cond,
+                **branch_kwargs["null"],
             )
-            return pred + (pred - null_pred) * cfg_strength
+            return pred + (pred - null_pred) * step_cfg_strength
 
         # noise input
         # to make sure batch inference result is same with different batch size, and for sure single inference
@@ -197,9 +330,21 @@ class CFM(nn.Module):
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+        # native fixed-step solvers only keep the current state, the trajectory is kept if asked for
+        method = self.odeint_kwargs.get("method", "euler")
+        use_fixed_step = method in fixed_step_methods and set(self.odeint_kwargs) <= {"method", "atol", "rtol"}
+
+        # schedule is fixed before integration, off-grid evaluations (if any) compute time cond on the fly
+        time_conds = self.get_time_cond_table(fixed_step_eval_times(t, method) if use_fixed_step else t)
+
+        if use_fixed_step:
+            sampled, trajectory = odeint_fixed_step(fn, y0, t, method=method, return_trajectory=return_trajectory)
+        else:
+            from torchdiffeq import odeint
+
+            trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+            sampled = trajectory[-1]
 
-        sampled = trajectory[-1]
         out = sampled
         out = torch.where(cond_mask, cond, out)
 
@@ -216,6 +361,9 @@ class CFM(nn.Module):
         *,
         lens: int["b"] | None = None,  # noqa: F821
         noise_scheduler: str | None = None,
+        teacher: CFM | None = None,  # frozen teacher for few-step and/or guidance distillation, see Trainer
+        teacher_steps=32,
+        sway_sampling_coef=-1.0,  # of the student's native schedule, use the same for sampling
     ):
         # handle raw wave
         if inp.ndim == 2:
@@ -227,10 +375,7 @@ class CFM(nn.Module):
 
         # handle text as string
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            text = self.tokenize(text)
             assert text.shape[0] == batch
 
         # lens and mask
@@ -253,7 +398,18 @@ class CFM(nn.Module):
         x0 = torch.randn_like(x1)
 
         # time step
-        time = torch.rand((batch,), dtype=dtype, device=self.device)
+        if exists(teacher):
+            assert exists(self.native_steps) or exists(
+                self.distilled_cfg_strength
+            ), "native_steps or distilled_cfg_strength of the student must be set for distillation"
+        if exists(teacher) and exists(self.native_steps):  # start of a random step on the student's native schedule
+            native_t = torch.linspace(0, 1, self.native_steps + 1, device=self.device, dtype=dtype)
+            if sway_sampling_coef is not None:
+                native_t = native_t + sway_sampling_coef * (torch.cos(torch.pi / 2 * native_t) - 1 + native_t)
+            step_idx = torch.randint(0, self.native_steps, (batch,), device=self.device)
+            time, time_next = native_t[step_idx], native_t[step_idx + 1]
+        else:
+            time = torch.rand((batch,), dtype=dtype, device=self.device)
         # TODO. noise_scheduler
 
         # sample xt (φ_t(x) in the paper)
@@ -272,12 +428,42 @@ class CFM(nn.Module):
         else:
             drop_text = False
 
+        # guidance-distilled student is purely conditional, it never runs a null branch
+        if exists(teacher) and exists(self.distilled_cfg_strength):
+            drop_audio_cond = drop_text = False
+
         # if want rigourously mask out padding, record in collate_fn in dataset.py, and pass in here
         # adding mask will use more memory, thus also need to adjust batchsampler with scaled down threshold for long sequences
         pred = self.transformer(
             x=φ, cond=cond, text=text, time=time, drop_audio_cond=drop_audio_cond, drop_text=drop_text
         )
 
+        if exists(teacher):
+            with torch.no_grad():
+
+                def teacher_fn(x, time):
+                    teacher_pred = teacher.transformer(
+                        x=x, cond=cond, text=text, time=time, drop_audio_cond=drop_audio_cond, drop_text=drop_text
+                    )
+                    if not exists(self.distilled_cfg_strength):
+                        return teacher_pred
+                    # bake the cfg combination into the student's single conditional pass
+                    null_pred = teacher.transformer(
+                        x=x, cond=cond, text=text, time=time, drop_audio_cond=True, drop_text=True
+                    )
+                    return teacher_pred + (teacher_pred - null_pred) * self.distilled_cfg_strength
+
+                if exists(self.native_steps):
+                    # the student learns the mean flow of one native step, from teacher trajectory over finer euler steps
+                    teacher_substeps = max(teacher_steps // self.native_steps, 1)
+                    dt = (time_next - time) / teacher_substeps
+                    x = φ
+                    for i in range(teacher_substeps):
+                        x = x + teacher_fn(x, time + i * dt) * dt[:, None, None]
+                    flow = (x - φ) / (time_next - time)[:, None, None]
+                else:
+                    flow = teacher_fn(φ, time)
+
         # flow matching loss
         loss = F.mse_loss(pred, flow, reduction="none")
         loss = loss[rand_span_mask]
@@ -15,7 +15,6 @@ from typing import Optional
 import torch
 import torch.nn.functional as F
 import torchaudio
-from librosa.filters import mel as librosa_mel_fn
 from torch import nn
 from x_transformers.x_transformers import apply_rotary_pos_emb
 
@@ -42,6 +41,8 @@ def get_bigvgan_mel_spectrogram(
     key = f"{n_fft}_{n_mel_channels}_{target_sample_rate}_{hop_length}_{win_length}_{fmin}_{fmax}_{device}"
 
     if key not in mel_basis_cache:
+        from librosa.filters import mel as librosa_mel_fn  # imported here, librosa (scipy) is slow to import
+
         mel = librosa_mel_fn(sr=target_sample_rate, n_fft=n_fft, n_mels=n_mel_channels, fmin=fmin, fmax=fmax)
         mel_basis_cache[key] = torch.from_numpy(mel).float().to(device)  # TODO: why they need .float()?
         hann_window_cache[key] = torch.hann_window(win_length).to(device)
@@ -181,12 +182,15 @@ class ConvPositionEmbedding(nn.Module):
             x = x.masked_fill(~mask, 0.0)
 
         x = x.permute(0, 2, 1)
-        x = self.conv1d(x)
+        if mask is not None:  # keep padding zero between the convs too, as if each sequence ended there
+            for layer in self.conv1d:
+                x = layer(x)
+                if isinstance(layer, nn.Mish):
+                    x = x.masked_fill(~mask.permute(0, 2, 1), 0.0)
+        else:
+            x = self.conv1d(x)
         out = x.permute(0, 2, 1)
 
-        if mask is not None:
-            out = out.masked_fill(~mask, 0.0)
-
         return out
 
 
@@ -228,7 +232,9 @@ class GRN(nn.Module):
         self.gamma = nn.Parameter(torch.zeros(1, 1, dim))
         self.beta = nn.Parameter(torch.zeros(1, 1, dim))
 
-    def forward(self, x):
+    def forward(self, x, mask: bool["b n"] | None = None):  # noqa: F722
+        if mask is not None:  # global response over valid positions only
+            x = x.masked_fill(~mask[..., None], 0.0)
         Gx = torch.norm(x, p=2, dim=1, keepdim=True)
         Nx = Gx / (Gx.mean(dim=-1, keepdim=True) + 1e-6)
         return self.gamma * (x * Nx) + self.beta + x
@@ -256,15 +262,17 @@ class ConvNeXtV2Block(nn.Module):
         self.grn = GRN(intermediate_dim)
         self.pwconv2 = nn.Linear(intermediate_dim, dim)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, mask: bool["b n"] | None = None) -> torch.Tensor:  # noqa: F722
         residual = x
+        if mask is not None:  # padding of a batch zeroed as if at sequence end
+            x = x.masked_fill(~mask[..., None], 0.0)
         x = x.transpose(1, 2)  # b n d -> b d n
         x = self.dwconv(x)
         x = x.transpose(1, 2)  # b d n -> b n d
         x = self.norm(x)
         x = self.pwconv1(x)
         x = self.act(x)
-        x = self.grn(x)
+        x = self.grn(x, mask=mask)
         x = self.pwconv2(x)
         return residual + x
 
@@ -282,8 +290,11 @@ class AdaLayerNormZero(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb=None):
-        emb = self.linear(self.silu(emb))
+    def get_mod(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb=None, mod=None):  # mod: precomputed self.linear(self.silu(emb)), see get_mod()
+        emb = self.get_mod(emb) if mod is None else mod
         shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(emb, 6, dim=1)
 
         x = self.norm(x) * (1 + scale_msa[:, None]) + shift_msa[:, None]
@@ -303,8 +314,11 @@ class AdaLayerNormZero_Final(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb):
-        emb = self.linear(self.silu(emb))
+    def get_mod(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb=None, mod=None):  # mod: precomputed self.linear(self.silu(emb)), see get_mod()
+        emb = self.get_mod(emb) if mod is None else mod
         scale, shift = torch.chunk(emb, 2, dim=1)
 
         x = self.norm(x) * (1 + scale)[:, None, :] + shift[:, None, :]
@@ -428,8 +442,7 @@ class AttnProcessor:
         # mask. e.g. inference got a batch with different target durations, mask out the padding
         if mask is not None:
             attn_mask = mask
-            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
-            attn_mask = attn_mask.expand(batch_size, attn.heads, query.shape[-2], key.shape[-2])
+            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n', key padding mask broadcast by sdpa
         else:
             attn_mask = None
 
@@ -506,8 +519,7 @@ class JointAttnProcessor:
         # mask. e.g. inference got a batch with different target durations, mask out the padding
         if mask is not None:
             attn_mask = F.pad(mask, (0, c.shape[1]), value=True)  # no mask for c (text)
-            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
-            attn_mask = attn_mask.expand(batch_size, attn.heads, query.shape[-2], key.shape[-2])
+            attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n', key padding mask broadcast by sdpa
         else:
             attn_mask = None
 
@@ -555,9 +567,9 @@ class DiTBlock(nn.Module):
         self.ff_norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, t, mask=None, rope=None):  # x: noised input, t: time embedding
+    def forward(self, x, t, mask=None, rope=None, t_mod=None):  # x: noised input, t: time embedding
         # pre-norm & modulation for attention input
-        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t, mod=t_mod)
 
         # attention
         attn_output = self.attn(x=norm, mask=mask, rope=rope)
@@ -611,13 +623,17 @@ class MMDiTBlock(nn.Module):
         self.ff_norm_x = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff_x = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, c, t, mask=None, rope=None, c_rope=None):  # x: noised input, c: context, t: time embedding
+    def forward(
+        self, x, c, t, mask=None, rope=None, c_rope=None, t_mod=None
+    ):  # x: noised input, c: context, t: time embedding, t_mod: precomputed (c, x) modulations
+        c_mod, x_mod = t_mod if t_mod is not None else (None, None)
+
         # pre-norm & modulation for attention input
         if self.context_pre_only:
-            norm_c = self.attn_norm_c(c, t)
+            norm_c = self.attn_norm_c(c, t, mod=c_mod)
         else:
-            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(c, emb=t)
-        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t)
+            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(c, emb=t, mod=c_mod)
+        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t, mod=x_mod)
 
         # attention
         x_attn_output, c_attn_output = self.attn(x=norm_x, c=norm_c, mask=mask, rope=rope, c_rope=c_rope)
@@ -49,6 +49,8 @@ class Trainer:
         mel_spec_type: str = "vocos",  # "vocos" | "bigvgan"
         is_local_vocoder: bool = False,  # use local path vocoder
         local_vocoder_path: str = "",  # local vocoder path
+        teacher_model: CFM | None = None,  # frozen teacher for few-step / guidance distillation, see CFM.forward()
+        distill_kwargs: dict = dict(),  # teacher_steps, sway_sampling_coef of the student's native schedule
     ):
         ddp_kwargs = DistributedDataParallelKwargs(find_unused_parameters=True)
 
@@ -85,6 +87,9 @@ class Trainer:
                     "max_grad_norm": max_grad_norm,
                     "gpus": self.accelerator.num_processes,
                     "noise_scheduler": noise_scheduler,
+                    "native_steps": model.native_steps,
+                    "distilled_cfg_strength": model.distilled_cfg_strength,
+                    **distill_kwargs,
                 },
             )
 
@@ -120,6 +125,15 @@ class Trainer:
 
         self.duration_predictor = duration_predictor
 
+        # few-step / guidance distillation, the teacher is only used for targets and not prepared by accelerator
+        self.teacher_model = teacher_model
+        self.distill_kwargs = distill_kwargs
+        if exists(teacher_model):
+            assert exists(model.native_steps) or exists(
+                model.distilled_cfg_strength
+            ), "native_steps or distilled_cfg_strength of the student must be set for distillation"
+            self.teacher_model.to(self.accelerator.device).eval().requires_grad_(False)
+
         if bnb_optimizer:
             import bitsandbytes as bnb
 
@@ -142,6 +156,11 @@ class Trainer:
                 scheduler_state_dict=self.scheduler.state_dict(),
                 step=step,
             )
+            unwrapped_model = self.accelerator.unwrap_model(self.model)
+            if exists(unwrapped_model.native_steps):  # few-step student, sampled with this many steps by default
+                checkpoint["native_steps"] = unwrapped_model.native_steps
+            if exists(unwrapped_model.distilled_cfg_strength):  # guidance-distilled, sampled without null branch
+                checkpoint["distilled_cfg_strength"] = unwrapped_model.distilled_cfg_strength
             if not os.path.exists(self.checkpoint_path):
                 os.makedirs(self.checkpoint_path)
             if last:
@@ -203,7 +222,14 @@ class Trainer:
 
     def train(self, train_dataset: Dataset, num_workers=16, resumable_with_seed: int = None):
         if self.log_samples:
-            from f5_tts.infer.utils_infer import cfg_strength, load_vocoder, nfe_step, sway_sampling_coef
+            from f5_tts.infer.utils_infer import (
+                cfg_strength,
+                decode_mel,
+                load_vocoder,
+                nfe_step,
+                sway_sampling_coef,
+                vocoder_max_frames,
+            )
 
             vocoder = load_vocoder(
                 vocoder_name=self.vocoder_name, is_local=self.is_local_vocoder, local_path=self.local_vocoder_path
@@ -304,7 +330,12 @@ class Trainer:
                         self.accelerator.log({"duration loss": dur_loss.item()}, step=global_step)
 
                     loss, cond, pred = self.model(
-                        mel_spec, text=text_inputs, lens=mel_lengths, noise_scheduler=self.noise_scheduler
+                        mel_spec,
+                        text=text_inputs,
+                        lens=mel_lengths,
+                        noise_scheduler=self.noise_scheduler,
+                        teacher=self.teacher_model,
+                        **self.distill_kwargs,
                     )
                     self.accelerator.backward(loss)
 
@@ -337,6 +368,7 @@ class Trainer:
                             text_inputs[0] + ([" "] if isinstance(text_inputs[0], list) else " ") + text_inputs[0]
                         ]
                         with torch.inference_mode():
+                            self.accelerator.unwrap_model(self.model).clear_time_cond_cache()  # weights updated
                             generated, _ = self.accelerator.unwrap_model(self.model).sample(
                                 cond=mel_spec[0][:ref_audio_len].unsqueeze(0),
                                 text=infer_text,
@@ -348,12 +380,8 @@ class Trainer:
                             generated = generated.to(torch.float32)
                             gen_mel_spec = generated[:, ref_audio_len:, :].permute(0, 2, 1).to(self.accelerator.device)
                             ref_mel_spec = batch["mel"][0].unsqueeze(0)
-                            if self.vocoder_name == "vocos":
-                                gen_audio = vocoder.decode(gen_mel_spec).cpu()
-                                ref_audio = vocoder.decode(ref_mel_spec).cpu()
-                            elif self.vocoder_name == "bigvgan":
-                                gen_audio = vocoder(gen_mel_spec).squeeze(0).cpu()
-                                ref_audio = vocoder(ref_mel_spec).squeeze(0).cpu()
+                            gen_audio = decode_mel(vocoder, gen_mel_spec, self.vocoder_name, vocoder_max_frames).cpu()
+                            ref_audio = decode_mel(vocoder, ref_mel_spec, self.vocoder_name, vocoder_max_frames).cpu()
 
                         torchaudio.save(f"{log_samples_path}/step_{global_step}_gen.wav", gen_audio, target_sample_rate)
                         torchaudio.save(f"{log_samples_path}/step_{global_step}_ref.wav", ref_audio, target_sample_rate)
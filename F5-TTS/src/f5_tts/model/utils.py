@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import math
 import os
 import random
 from collections import defaultdict
@@ -77,9 +78,91 @@ def maybe_masked_mean(t: float["b n d"], mask: bool["b n"] = None) -> float["b d
     return num / den.clamp(min=1.0)
 
 
+# classifier-free guidance schedule
+
+
+def get_cfg_strength(t: float, cfg_strength: float, cfg_schedule: str | tuple[float, float] | None = None) -> float:
+    """
+    cfg_schedule    - None for constant cfg_strength along the ode
+                    - (t_lo, t_hi) to apply guidance only for t_lo <= t <= t_hi, skipping the null pass elsewhere
+                    - "linear" | "cosine" to decay cfg_strength from t = 0 down to 0 at t = 1. only shapes the guidance,
+                      the ode never evaluates t = 1 so every step still runs the null pass, no speedup
+    """
+    if cfg_schedule is None:
+        return cfg_strength
+    elif cfg_schedule == "linear":
+        return cfg_strength * (1 - t)
+    elif cfg_schedule == "cosine":
+        return cfg_strength * math.cos(math.pi / 2 * t)
+    elif isinstance(cfg_schedule, (tuple, list)) and len(cfg_schedule) == 2:
+        t_lo, t_hi = cfg_schedule
+        return cfg_strength if t_lo <= t <= t_hi else 0.0
+    raise ValueError(f"cfg_schedule must be None, 'linear', 'cosine' or (t_lo, t_hi), but received {cfg_schedule}")
+
+
+# fixed-step ode solvers, keep only the current state instead of the whole trajectory
+# ab2, ab3: adams-bashforth multistep, reuse previous velocity predictions so one nfe per step at higher order
+
+fixed_step_methods = ["euler", "midpoint", "heun", "ab2", "ab3"]
+
+
+def adams_bashforth_coeffs(ts: list[float], t_next: float) -> list[float]:
+    # weights of f(ts[j]) (newest first) integrating their lagrange interpolant over [ts[0], t_next]
+    # exact for non-uniform grids, e.g. with sway sampling. in shifted time u = s - ts[0]
+    nodes = [tj - ts[0] for tj in ts]
+    h = t_next - ts[0]
+    coeffs = []
+    for j, node_j in enumerate(nodes):
+        poly = [1.0]  # ascending powers of u
+        for m, node_m in enumerate(nodes):
+            if m == j:
+                continue
+            scale = 1.0 / (node_j - node_m)
+            shifted = [0.0] + poly  # u * poly
+            poly = [(shifted[k] - node_m * (poly[k] if k < len(poly) else 0.0)) * scale for k in range(len(shifted))]
+        coeffs.append(sum(c * h ** (k + 1) / (k + 1) for k, c in enumerate(poly)))
+    return coeffs
+
+
+def fixed_step_eval_times(t: float["s"], method="euler") -> float["e"]:  # noqa: F821
+    # all time points the solver evaluates func at, computed the same way as in odeint_fixed_step()
+    if method == "midpoint":
+        return torch.cat((t, t[:-1] + (t[1:] - t[:-1]) / 2))
+    return t
+
+
+def odeint_fixed_step(func, y0: float["b n d"], t: float["s"], method="euler", return_trajectory=False):  # noqa: F722 F821
+    if method not in fixed_step_methods:
+        raise ValueError(f"method must be one of {fixed_step_methods}, but received {method}")
+
+    y = y0
+    trajectory = [y0] if return_trajectory else None
+    if method.startswith("ab"):  # warm up with lower orders until enough previous predictions
+        order, t_list, history = int(method[2:]), t.tolist(), []
+    for i, (t0, t1) in enumerate(zip(t[:-1], t[1:])):
+        dt = t1 - t0
+        if method.startswith("ab"):
+            history = [func(t0, y)] + history[: order - 1]
+            coeffs = adams_bashforth_coeffs(t_list[i::-1][: len(history)], t_list[i + 1])
+            y = y + sum(coeff * f for coeff, f in zip(coeffs, history))
+        elif method == "euler":
+            y = y + dt * func(t0, y)
+        elif method == "midpoint":
+            y_mid = y + dt / 2 * func(t0, y)
+            y = y + dt * func(t0 + dt / 2, y_mid)
+        elif method == "heun":
+            k1 = func(t0, y)
+            k2 = func(t1, y + dt * k1)
+            y = y + dt / 2 * (k1 + k2)
+        if return_trajectory:
+            trajectory.append(y)
+
+    return y, torch.stack(trajectory) if return_trajectory else None
+
+
 # simple utf-8 tokenizer, since paper went character based
 def list_str_to_tensor(text: list[str], padding_value=-1) -> int["b nt"]:  # noqa: F722
-    list_tensors = [torch.tensor([*bytes(t, "UTF-8")]) for t in text]  # ByT5 style
+    list_tensors = [torch.tensor([*bytes(t, "UTF-8")], dtype=torch.long) for t in text]  # ByT5 style
     text = pad_sequence(list_tensors, padding_value=padding_value, batch_first=True)
     return text
 
@@ -90,11 +173,33 @@ def list_str_to_idx(
     vocab_char_map: dict[str, int],  # {char: idx}
     padding_value=-1,
 ) -> int["b nt"]:  # noqa: F722
-    list_idx_tensors = [torch.tensor([vocab_char_map.get(c, 0) for c in t]) for t in text]  # pinyin or char style
+    # pinyin or char style
+    list_idx_tensors = [torch.tensor([vocab_char_map.get(c, 0) for c in t], dtype=torch.long) for t in text]
     text = pad_sequence(list_idx_tensors, padding_value=padding_value, batch_first=True)
     return text
 
 
+# reference prompt, prepared once and reused for every chunk generated with the same reference
+
+
+class RefPrompt:
+    def __init__(
+        self,
+        mel: float["n d"],  # noqa: F722
+        text_ids: int["nt"],  # noqa: F821
+        text: str,
+        rms: float,
+        audio_len: int,
+        text_tail: str = "",
+    ):
+        self.mel = mel  # reference mel frames
+        self.text_ids = text_ids  # token ids of reference text, without text_tail
+        self.text = text  # reference text, for duration estimate of generated text
+        self.text_tail = text_tail  # end of reference text, tokenized along with each generated text
+        self.rms = rms  # rms of reference audio before loudness normalization
+        self.audio_len = audio_len  # reference length in hops, where generated audio starts
+
+
 # Get tokenizer
 
 
@@ -171,6 +276,20 @@ def convert_char_to_pinyin(text_list, polyphone=True):
     return final_text_list
 
 
+# split reference text so that convert_char_to_pinyin([head])[0] + convert_char_to_pinyin([tail + gen_text])[0]
+# equals convert_char_to_pinyin([ref_text + gen_text])[0]. jieba segments each run of han & alphanumeric characters
+# as a whole, and the spacing of a segment depends on the previous token, so the tail starts at the last character
+# outside of such a run (converted alike in any context), or is all of ref_text if there is none
+
+
+def split_ref_text(ref_text):
+    i = len(ref_text)
+    while i > 0 and (jieba.re_han_default.match(ref_text[i - 1]) or "\r\n" in ref_text[max(i - 2, 0) : i + 1]):
+        i -= 1  # also skip the two characters of "\r\n", a single segment spaced by context
+    i = max(i - 1, 0)
+    return ref_text[:i], ref_text[i:]
+
+
 # filter func for dirty data with many repetitions
 
 
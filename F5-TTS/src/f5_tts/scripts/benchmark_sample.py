@@ -0,0 +1,105 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+
+import argparse
+import time
+
+import torch
+
+from f5_tts.model import CFM, DiT, MMDiT, UNetT
+
+
+# benchmark CFM.sample with randomly initialized backbones, no checkpoint needed
+# e.g. python src/f5_tts/scripts/benchmark_sample.py --model F5TTS_Base --nfe 32 --device cpu
+
+
+model_cfgs = {
+    "F5TTS_Base": (DiT, dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)),
+    "F5TTS_Small": (DiT, dict(dim=768, depth=18, heads=12, ff_mult=2, text_dim=512, conv_layers=4)),
+    "E2TTS_Base": (UNetT, dict(dim=1024, depth=24, heads=16, ff_mult=4)),
+    "MMDiT_Small": (MMDiT, dict(dim=512, depth=16, heads=16, ff_mult=2)),
+}
+
+parser = argparse.ArgumentParser(description="CFM.sample benchmark")
+parser.add_argument("--model", default="F5TTS_Base", choices=list(model_cfgs.keys()))
+parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+parser.add_argument("--batch", default=1, type=int)
+parser.add_argument("--ref_secs", default=5.0, type=float)
+parser.add_argument("--gen_secs", default=10.0, type=float)
+parser.add_argument("--text_length", default=150, type=int)
+parser.add_argument("--nfe", default=32, type=int)
+parser.add_argument("--cfg_strength", default=2.0, type=float)
+parser.add_argument("--sway_sampling_coef", default=-1.0, type=float)
+parser.add_argument("--repeats", default=3, type=int)
+parser.add_argument("--threads", default=None, type=int)
+parser.add_argument("--compare", default="batch_cfg", choices=["batch_cfg", "trajectory", "cfg_schedule", "block_cache"])
+args = parser.parse_args()
+
+# (name, sample kwargs) of baseline and candidate for each comparison
+comparisons = {
+    "batch_cfg": [("two-pass cfg", dict(batch_cfg=False)), ("batched cfg", dict(batch_cfg=True))],
+    "trajectory": [("keep trajectory", dict(return_trajectory=True)), ("final state only", dict())],
+    "cfg_schedule": [("cfg on all steps", dict()), ("cfg on t in [0, 0.7]", dict(cfg_schedule=(0.0, 0.7)))],
+    "block_cache": [("no block cache", dict()), ("block cache interval 3", dict(block_cache=dict(interval=3)))],
+}
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+target_sample_rate = 24000
+n_mel_channels = 100
+hop_length = 256
+vocab_size = 2545
+
+model_cls, model_cfg = model_cfgs[args.model]
+model = CFM(transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels)).to(args.device)
+model.eval()
+
+ref_len = int(args.ref_secs * target_sample_rate / hop_length)
+duration = ref_len + int(args.gen_secs * target_sample_rate / hop_length)
+cond = torch.randn(args.batch, ref_len, n_mel_channels, device=args.device)
+text = torch.randint(0, vocab_size, (args.batch, args.text_length), device=args.device)
+
+
+def run(**sample_kwargs):
+    with torch.inference_mode():
+        out, _ = model.sample(
+            cond=cond,
+            text=text,
+            duration=duration,
+            steps=args.nfe,
+            cfg_strength=args.cfg_strength,
+            sway_sampling_coef=args.sway_sampling_coef,
+            seed=0,
+            **sample_kwargs,
+        )
+    return out
+
+
+def bench(name, **sample_kwargs):
+    run(**sample_kwargs)  # warm up
+    if "cuda" in args.device:
+        torch.cuda.reset_peak_memory_stats()
+    timings = []
+    for _ in range(args.repeats):
+        if "cuda" in args.device:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        out = run(**sample_kwargs)
+        if "cuda" in args.device:
+            torch.cuda.synchronize()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    peak_mem = f"  |  peak {torch.cuda.max_memory_allocated() / 2**20:8.1f} MiB" if "cuda" in args.device else ""
+    print(f"{name:<24} best {best:8.3f} s  |  {best / args.nfe * 1000:8.2f} ms/step{peak_mem}")
+    return out, best
+
+
+print(f"{args.model}, batch {args.batch}, {duration} frames, nfe {args.nfe}, device {args.device}\n")
+
+(ref_name, ref_kwargs), (new_name, new_kwargs) = comparisons[args.compare]
+out_ref, t_ref = bench(ref_name, **ref_kwargs)
+out_new, t_new = bench(new_name, **new_kwargs)
+print(f"\nspeedup: {t_ref / t_new:.2f}x, max abs diff: {(out_ref - out_new).abs().max().item():.3e}")
@@ -0,0 +1,81 @@
+import sys
+import os
+
+sys.path.append(os.getcwd())
+
+import argparse
+import asyncio
+import time
+
+from f5_tts.socket_client import FLOAT32, INT16, TTSClient, sample_rate
+
+
+# load test for socket_server.py, N concurrent clients each sending requests one after another
+# e.g. python src/f5_tts/scripts/loadtest_socket_server.py --port 9998 --clients 1,8,32
+# against the thread-per-client baseline as well, started alongside with socket_server.py --threaded --port 9999
+# e.g. python src/f5_tts/scripts/loadtest_socket_server.py --port 9998 --baseline_port 9999
+
+
+parser = argparse.ArgumentParser(description="socket server load test")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", default=9998, type=int)
+parser.add_argument("--baseline_port", default=None, type=int, help="port of a socket_server.py --threaded to compare")
+parser.add_argument("--clients", default="1,8,32", help="comma separated numbers of concurrent clients")
+parser.add_argument("--requests", default=2, type=int, help="requests per client")
+parser.add_argument("--int16", action="store_true", help="receive 16-bit pcm instead of float32")
+parser.add_argument(
+    "--text",
+    default="I don't really care what you call me. I've been a silent spectator, watching species evolve, "
+    "empires rise and fall. But always remember, I am mighty and enduring.",
+)
+args = parser.parse_args()
+
+
+async def request(tts_client, text):
+    # returns time to first audio, total latency, and seconds of audio received
+    start, first, samples = time.perf_counter(), None, 0
+    async for audio in tts_client.stream(text):
+        if first is None:
+            first = time.perf_counter() - start
+        samples += len(audio)
+    return first, time.perf_counter() - start, samples / sample_rate
+
+
+async def client(port, text, num_requests):
+    tts_client = TTSClient(args.host, port, INT16 if args.int16 else FLOAT32)
+    await tts_client.connect()
+    try:
+        return [await request(tts_client, text) for _ in range(num_requests)]
+    finally:
+        await tts_client.close()
+
+
+def percentile(values, q):
+    values = sorted(value for value in values if value is not None)  # None: request without audio
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def main():
+    servers = [("batched", args.port)]
+    if args.baseline_port is not None:
+        servers.append(("thread per client", args.baseline_port))
+
+    print(f"{args.host}, {args.requests} requests per client\n")
+    for num_clients in [int(n) for n in args.clients.split(",")]:
+        for name, port in servers:
+            start = time.perf_counter()
+            results = await asyncio.gather(*[client(port, args.text, args.requests) for _ in range(num_clients)])
+            wall = time.perf_counter() - start
+
+            results = [result for client_results in results for result in client_results]
+            ttfb, latency, audio = zip(*results)
+            print(
+                f"{num_clients:>3} clients  {name:<17}  |  ttfb p50 {percentile(ttfb, 0.5):7.2f} s"
+                f"  p95 {percentile(ttfb, 0.95):7.2f} s  |  latency p50 {percentile(latency, 0.5):7.2f} s"
+                f"  p95 {percentile(latency, 0.95):7.2f} s  |  {sum(audio) / wall:6.2f} s audio / s"
+            )
+
+
+asyncio.run(main())
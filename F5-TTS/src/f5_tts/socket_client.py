@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import itertools
+import struct
+import time
+
+import numpy as np
+
+
+# wire format of socket_server.py, kept here so that clients need numpy only
+#
+# request (client -> server): REQUEST header (request id, sample format, text length in bytes), then the utf-8 text
+# response (server -> client): FRAME header (request id, kind, payload length in bytes), then the payload. Frames
+# of kind FLOAT32 / INT16 carry little-endian mono pcm at sample_rate, one frame per generated piece of audio, a frame
+# of kind END closes the request, one of kind ERROR closes it with a utf-8 message instead
+
+REQUEST = struct.Struct("!IBI")
+FRAME = struct.Struct("!IBI")
+FLOAT32, INT16, END, ERROR = 0, 1, 2, 3
+sample_rate = 24000
+
+dtypes = {FLOAT32: np.dtype("<f4"), INT16: np.dtype("<i2")}
+
+
+def encode_request(request_id, text, sample_format=FLOAT32):
+    text = text.encode("utf-8")
+    return REQUEST.pack(request_id, sample_format, len(text)) + text
+
+
+def encode_audio(request_id, audio, sample_format=FLOAT32):
+    # header and a view of the pcm, for writer.writelines, no per sample python work
+    if sample_format == INT16:
+        audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(dtypes[INT16])
+    else:
+        audio = np.ascontiguousarray(audio, dtype=dtypes[FLOAT32])
+    payload = memoryview(audio).cast("B")
+    return FRAME.pack(request_id, sample_format, len(payload)), payload
+
+
+def encode_end(request_id, error=None):
+    if error is None:
+        return FRAME.pack(request_id, END, 0)
+    message = str(error).encode("utf-8")
+    return FRAME.pack(request_id, ERROR, len(message)) + message
+
+
+def decode_audio(payload, sample_format):
+    # float32 audio in [-1, 1] from either pcm format
+    audio = np.frombuffer(payload, dtype=dtypes[sample_format])
+    if sample_format == INT16:
+        return audio.astype(np.float32) / 32767
+    return audio
+
+
+async def read_frame(reader):
+    request_id, kind, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return request_id, kind, await reader.readexactly(length)
+
+
+class TTSClient:
+    """Reference client, requests on one connection are sent one after another."""
+
+    def __init__(self, host="localhost", port=9998, sample_format=FLOAT32):
+        self.host = host
+        self.port = port
+        self.sample_format = sample_format
+        self.request_ids = itertools.count()
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def stream(self, text):
+        """Send text, yield float32 audio as the server generates it."""
+        request_id = next(self.request_ids)
+        self.writer.write(encode_request(request_id, text, self.sample_format))
+        await self.writer.drain()
+
+        while True:
+            frame_id, kind, payload = await read_frame(self.reader)
+            if frame_id != request_id:
+                raise RuntimeError(f"Frame of request {frame_id} while waiting for request {request_id}")
+            if kind == END:
+                return
+            if kind == ERROR:
+                raise RuntimeError(f"Server error: {payload.decode('utf-8')}")
+            yield decode_audio(payload, kind)
+
+    async def synthesize(self, text):
+        return np.concatenate([audio async for audio in self.stream(text)] or [np.zeros(0, dtype=np.float32)])
+
+
+async def main(args):
+    import soundfile as sf
+
+    client = TTSClient(args.host, args.port, INT16 if args.int16 else FLOAT32)
+    await client.connect()
+    try:
+        start, first, chunks = time.perf_counter(), None, []
+        async for audio in client.stream(args.text):
+            if first is None:
+                first = time.perf_counter() - start
+                print(f"first audio after {first:.2f} s")
+            chunks.append(audio)
+        audio = np.concatenate(chunks or [np.zeros(0, dtype=np.float32)])
+        print(f"{len(audio) / sample_rate:.2f} s of audio in {time.perf_counter() - start:.2f} s")
+        sf.write(args.output, audio, sample_rate)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="socket server client, writes the streamed audio to a file")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default=9998, type=int)
+    parser.add_argument("--text", default="my name is jenny..")
+    parser.add_argument("--int16", action="store_true", help="receive 16-bit pcm, half the bytes of float32")
+    parser.add_argument("--output", default="socket_out.wav")
+    asyncio.run(main(parser.parse_args()))
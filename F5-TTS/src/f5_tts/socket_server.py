@@ -1,7 +1,10 @@
+import argparse
+import asyncio
+import contextlib
 import socket
-import struct
 import torch
 import torchaudio
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 
@@ -9,16 +12,52 @@ import gc
 import traceback
 
 
-from infer.utils_infer import infer_batch_process, preprocess_ref_audio_text, load_vocoder, load_model
+from infer.utils_infer import (
+    CrossFadeAssembler,
+    chunk_text,
+    first_chunk_chars,
+    get_duration,
+    get_ref_prompt,
+    infer_batch_process,
+    infer_chunk_batches,
+    infer_process_stream,
+    max_batch_frames,
+    nfe_step,
+    preprocess_ref_audio_text,
+    model_registry,
+    set_voice_cache,
+)
 from model.backbones.dit import DiT
+from socket_client import REQUEST, dtypes, encode_audio, encode_end
+
+
+max_text_bytes = 64 * 1024  # longest request text, a longer one gets an ERROR frame and the connection is closed
+
+
+def text_too_long(length, max_text_bytes):
+    return ValueError(f"Text of {length} bytes, over the limit of {max_text_bytes} bytes")
 
 
 class TTSStreamingProcessor:
-    def __init__(self, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32):
+    def __init__(
+        self,
+        ckpt_file,
+        vocab_file,
+        ref_audio,
+        ref_text,
+        device=None,
+        dtype=torch.float32,
+        voice_cache_dir=None,
+        first_nfe_step=None,
+    ):
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
 
-        # Load the model using the provided checkpoint and vocab files
-        self.model = load_model(
+        # Persist processed reference voices, so a restarted server skips clipping, asr and mel extraction
+        if voice_cache_dir is not None:
+            set_voice_cache(voice_cache_dir)
+
+        # Load the model using the provided checkpoint and vocab files, shared with other processors of this process
+        self.model = model_registry.get_model(
             model_cls=DiT,
             model_cfg=dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4),
             ckpt_path=ckpt_file,
@@ -27,14 +66,18 @@ class TTSStreamingProcessor:
             ode_method="euler",
             use_ema=True,
             device=self.device,
-        ).to(self.device, dtype=dtype)
+            dtype=dtype,  # loaded as its own registry entry, other holders of the model keep theirs
+        )
 
         # Load the vocoder
-        self.vocoder = load_vocoder(is_local=False)
+        self.vocoder = model_registry.get_vocoder(is_local=False, device=self.device)
 
         # Set sampling rate for streaming
         self.sampling_rate = 24000  # Consistency with client
 
+        # Fewer denoising steps for the first text chunk, to send the first audio sooner
+        self.first_nfe_step = first_nfe_step
+
         # Set reference audio and text
         self.ref_audio = ref_audio
         self.ref_text = ref_text
@@ -42,6 +85,9 @@ class TTSStreamingProcessor:
         # Warm up the model
         self._warm_up()
 
+        # Reference prompt and chunk size, prepared once for the batched requests of all clients
+        self.prompt, self.max_chars = self.get_prompt()
+
     def _warm_up(self):
         """Warm up the model with a dummy input to ensure it's ready for real-time processing."""
         print("Warming up the model...")
@@ -53,90 +99,270 @@ class TTSStreamingProcessor:
         infer_batch_process((audio, sr), ref_text, [gen_text], self.model, self.vocoder, device=self.device)
         print("Warm-up completed.")
 
-    def generate_stream(self, text, play_steps_in_s=0.5):
-        """Generate audio in chunks and yield them in real-time."""
-        # Preprocess the reference audio and text
+    def get_prompt(self):
+        """Prepare the reference prompt, and the text chunk size from the speaking rate of the reference."""
         ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
-
-        # Load reference audio
         audio, sr = torchaudio.load(ref_audio)
+        max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+        return get_ref_prompt((audio, sr), ref_text, self.model, device=self.device), max_chars
+
+    def split_text(self, text):
+        """Split a request into text chunks, the first one short so its audio arrives early."""
+        return chunk_text(text, max_chars=self.max_chars, first_chars=first_chunk_chars)
+
+    def generate_batch(self, texts, first=False):
+        """Generate the audio of several text chunks, of different requests, in shared sample and vocoder calls."""
+        steps = self.first_nfe_step if first and self.first_nfe_step is not None else nfe_step
+        chunks = [(0, i, text, get_duration(self.prompt, text)) for i, text in enumerate(texts)]
+        result = infer_chunk_batches(
+            [self.prompt], chunks, self.model, self.vocoder, nfe_step=steps, device=self.device
+        )[0]
+        return [result[i][0] for i in range(len(texts))]
+
+    def generate_stream(self, text):
+        """Generate audio in chunks and yield them in real-time, unbatched (see start_threaded_server())."""
+        # Preprocess the reference audio and text
+        ref_audio, ref_text = preprocess_ref_audio_text(self.ref_audio, self.ref_text)
 
-        # Run inference for the input text
-        audio_chunk, final_sample_rate, _ = infer_batch_process(
-            (audio, sr),
+        # Run inference for the input text, sending each text chunk's audio as soon as it is vocoded
+        # the first text chunk is kept short, so the first audio arrives early
+        yield from infer_process_stream(
+            ref_audio,
             ref_text,
-            [text],
+            text,
             self.model,
             self.vocoder,
             device=self.device,  # Pass vocoder here
+            first_nfe_step=self.first_nfe_step,
         )
 
-        # Break the generated audio into chunks and send them
-        chunk_size = int(final_sample_rate * play_steps_in_s)
 
-        if len(audio_chunk) < chunk_size:
-            packed_audio = struct.pack(f"{len(audio_chunk)}f", *audio_chunk)
-            yield packed_audio
+class TTSRequest:
+    def __init__(self, chunks):
+        self.chunks = chunks  # text chunks, generated one per scheduling round
+        self.done = 0  # chunks generated so far
+        self.assembler = CrossFadeAssembler()  # cross-fades the chunks of this request as they come in
+        self.audio = asyncio.Queue()  # audio pieces for the client, then None at the end (or an exception)
+        self.cancelled = False  # client gone, drop the request
+
+
+class BatchScheduler:
+    """
+    Central queue for the requests of all clients. Each round, the next text chunk of every open request (in turn,
+    as many as the frame budget allows) is generated in one batched sample call, and the audio of each chunk is
+    fanned back out to its request. Requests arriving while a round runs join the next one, requests arriving
+    at an idle scheduler are gathered for max_wait seconds first. With first_nfe_step set, the first chunks of a
+    round are sampled in a call of their own with that many steps, ahead of the later chunks.
+
+    All requests are spoken with the reference voice of the processor, the one prompt their chunks are batched on,
+    the protocol has no voice selection. A request whose stream is closed (its client gone) is dropped before its
+    next chunk, a round already running still completes.
+    """
+
+    def __init__(self, processor, max_wait=0.05, max_batch_frames=max_batch_frames):
+        self.processor = processor
+        self.max_wait = max_wait
+        self.max_batch_frames = max_batch_frames
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)  # model calls one at a time, off the event loop
+
+    async def generate_stream(self, text):
+        """Submit a request, yield its cross-faded audio as each round produces it."""
+        request = TTSRequest(self.processor.split_text(text))
+        if not request.chunks:
             return
-
-        for i in range(0, len(audio_chunk), chunk_size):
-            chunk = audio_chunk[i : i + chunk_size]
-
-            # Check if it's the final chunk
-            if i + chunk_size >= len(audio_chunk):
-                chunk = audio_chunk[i:]
-
-            # Send the chunk if it is not empty
-            if len(chunk) > 0:
-                packed_audio = struct.pack(f"{len(chunk)}f", *chunk)
-                yield packed_audio
+        await self.queue.put(request)
+        try:
+            while (audio := await request.audio.get()) is not None:
+                if isinstance(audio, Exception):
+                    raise audio
+                yield audio
+        finally:
+            request.cancelled = True
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        active = []
+        while True:
+            if not active:  # idle, wait for a request, and gather those arriving shortly after
+                active.append(await self.queue.get())
+                deadline = loop.time() + self.max_wait
+                while (timeout := deadline - loop.time()) > 0:
+                    try:
+                        active.append(await asyncio.wait_for(self.queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            while not self.queue.empty():
+                active.append(self.queue.get_nowait())
+            active = [request for request in active if not request.cancelled]
+            if not active:
+                continue
+
+            # next chunk of requests in turn, padded to the longest within the frame budget
+            batch, longest = [], 0
+            for request in active:
+                duration = get_duration(self.processor.prompt, request.chunks[request.done])
+                if batch and (len(batch) + 1) * max(longest, duration) > self.max_batch_frames:
+                    break
+                batch.append(request)
+                longest = max(longest, duration)
+
+            # first chunks in a call of their own, with fewer steps and ahead of the rest, so new requests start sooner
+            if self.processor.first_nfe_step is not None:
+                groups = [(True, [r for r in batch if r.done == 0]), (False, [r for r in batch if r.done > 0])]
+            else:
+                groups = [(False, batch)]
+
+            failed = []
+            for first, group in groups:
+                group = [request for request in group if not request.cancelled]  # e.g. during the first group
+                if not group:
+                    continue
+                texts = [request.chunks[request.done] for request in group]
+                try:
+                    waves = await loop.run_in_executor(self.executor, self.processor.generate_batch, texts, first)
+                except Exception as e:
+                    traceback.print_exc()
+                    for request in group:
+                        request.audio.put_nowait(e)
+                    failed += group
+                    continue
+
+                for request, wave in zip(group, waves):
+                    request.done += 1
+                    pieces = [request.assembler.push(wave)]
+                    if request.done == len(request.chunks):
+                        pieces += [request.assembler.flush(), None]
+                    for piece in pieces:  # audio held back for the cross-fade comes out empty, no frame for it
+                        if piece is None or len(piece) > 0:
+                            request.audio.put_nowait(piece)
+
+            # requests served this round go last, so that those left out over budget come first next round
+            unfinished = [r for r in batch if r.done < len(r.chunks) and r not in failed]
+            active = [request for request in active if request not in batch] + unfinished
+
+
+async def send_audio(writer, scheduler, request_id, text, sample_format):
+    try:
+        # The client sends the text input
+        text = text.decode("utf-8").strip()
+        if sample_format not in dtypes:
+            raise ValueError(f"Unknown sample format {sample_format}")
+
+        # Generate and stream audio chunks, one frame each, the request is dropped from the scheduler once closed
+        async with contextlib.aclosing(scheduler.generate_stream(text)) as audio_chunks:
+            async for audio_chunk in audio_chunks:
+                writer.writelines(encode_audio(request_id, audio_chunk, sample_format))
+                await writer.drain()
+
+        # Send end-of-audio frame
+        writer.write(encode_end(request_id))
+
+    except ConnectionError:
+        return  # client gone
+    except Exception as e:
+        print(f"Error during processing: {e}")
+        traceback.print_exc()  # Print the full traceback to diagnose the issue
+        writer.write(encode_end(request_id, error=e))
+    with contextlib.suppress(ConnectionError):
+        await writer.drain()
 
 
-def handle_client(client_socket, processor):
+async def handle_client(reader, writer, scheduler, max_text_bytes=max_text_bytes):
+    # requests on a connection may overlap, their frames are told apart by request id
+    tasks = set()
     try:
         while True:
-            # Receive data from the client
-            data = client_socket.recv(1024).decode("utf-8")
-            if not data:
-                break
-
+            # Receive a request header, then exactly the text it announces
             try:
-                # The client sends the text input
-                text = data.strip()
-
-                # Generate and stream audio chunks
-                for audio_chunk in processor.generate_stream(text):
-                    client_socket.sendall(audio_chunk)
-
-                # Send end-of-audio signal
-                client_socket.sendall(b"END_OF_AUDIO")
-
-            except Exception as inner_e:
-                print(f"Error during processing: {inner_e}")
-                traceback.print_exc()  # Print the full traceback to diagnose the issue
-                break
+                request_id, sample_format, length = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                if length > max_text_bytes:  # not read, so the rest of the stream cannot be parsed either
+                    writer.write(encode_end(request_id, error=text_too_long(length, max_text_bytes)))
+                    break
+                text = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break  # connection closed, nobody left to send the audio to
+
+            task = asyncio.create_task(send_audio(writer, scheduler, request_id, text, sample_format))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
 
     except Exception as e:
         print(f"Error handling client: {e}")
         traceback.print_exc()
     finally:
-        client_socket.close()
+        for task in tasks:  # its queued requests leave the scheduler, running ones after the current round
+            task.cancel()
+        writer.close()
+
+
+async def serve(host, port, processor, max_wait=0.05, max_text_bytes=max_text_bytes):
+    scheduler = BatchScheduler(processor, max_wait=max_wait)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(reader, writer, scheduler, max_text_bytes), host, port
+    )
+    print(f"Server listening on {host}:{port}")
+
+    async with server:
+        await asyncio.gather(server.serve_forever(), scheduler.run())
+
 
+def start_server(host, port, processor, max_text_bytes=max_text_bytes):
+    asyncio.run(serve(host, port, processor, max_text_bytes=max_text_bytes))
 
-def start_server(host, port, processor):
+
+def handle_client_threaded(client_socket, processor, max_text_bytes=max_text_bytes):
+    # same protocol, requests of a connection one after another, each generated on its own
+    with client_socket, client_socket.makefile("rb") as reader:
+        while len(header := reader.read(REQUEST.size)) == REQUEST.size:
+            request_id, sample_format, length = REQUEST.unpack(header)
+            if length > max_text_bytes:
+                with contextlib.suppress(ConnectionError):
+                    client_socket.sendall(encode_end(request_id, error=text_too_long(length, max_text_bytes)))
+                break
+            text = reader.read(length)
+            try:
+                text = text.decode("utf-8").strip()
+                if sample_format not in dtypes:
+                    raise ValueError(f"Unknown sample format {sample_format}")
+                for audio_chunk in processor.generate_stream(text):
+                    if len(audio_chunk) == 0:
+                        continue
+                    for part in encode_audio(request_id, audio_chunk, sample_format):
+                        client_socket.sendall(part)
+                client_socket.sendall(encode_end(request_id))
+            except ConnectionError:
+                break
+            except Exception as e:
+                print(f"Error during processing: {e}")
+                traceback.print_exc()
+                try:
+                    client_socket.sendall(encode_end(request_id, error=e))
+                except ConnectionError:
+                    break  # client gone as well
+
+
+def start_threaded_server(host, port, processor, max_text_bytes=max_text_bytes):
+    """Thread per client, each calling the model directly, unbatched. Baseline for scripts/loadtest_socket_server.py"""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind((host, port))
-    server.listen(5)
-    print(f"Server listening on {host}:{port}")
+    server.listen()
+    print(f"Server listening on {host}:{port} (thread per client)")
 
     while True:
-        client_socket, addr = server.accept()
-        print(f"Accepted connection from {addr}")
-        client_handler = Thread(target=handle_client, args=(client_socket, processor))
-        client_handler.start()
+        client_socket, _ = server.accept()
+        Thread(target=handle_client_threaded, args=(client_socket, processor, max_text_bytes), daemon=True).start()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming TTS socket server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", default=9998, type=int)
+    parser.add_argument("--threaded", action="store_true", help="thread per client without batching, as a baseline")
+    parser.add_argument("--max_text_bytes", default=max_text_bytes, type=int, help="longest request text accepted")
+    args = parser.parse_args()
+
     try:
         # Load the model and vocoder using the provided files
         ckpt_file = ""  # pointing your checkpoint "ckpts/model/model_1096.pt"
@@ -154,6 +380,9 @@ if __name__ == "__main__":
         )
 
         # Start the server
-        start_server("0.0.0.0", 9998, processor)
+        if args.threaded:
+            start_threaded_server(args.host, args.port, processor, args.max_text_bytes)
+        else:
+            start_server(args.host, args.port, processor, args.max_text_bytes)
     except KeyboardInterrupt:
         gc.collect()
@@ -2,6 +2,8 @@
 
 from importlib.resources import files
 
+import torch
+
 from f5_tts.model import CFM, DiT, Trainer, UNetT
 from f5_tts.model.dataset import load_dataset
 from f5_tts.model.utils import get_tokenizer
@@ -47,6 +49,14 @@ elif exp_name == "E2TTS_Base":
     model_cfg = dict(dim=1024, depth=24, heads=16, ff_mult=4)
 
 
+# few-step / guidance distillation, set a teacher checkpoint to train a student sampling with native_steps instead
+# and / or with cfg of distill_cfg_strength baked in, thus a single conditional pass per step
+distill_teacher_ckpt = None  # e.g. str(files("f5_tts").joinpath("../../ckpts/F5TTS_Base/model_1200000.pt"))
+native_steps = 4  # 2-8, student steps. None to keep teacher's step count
+distill_cfg_strength = 2.0  # None to keep cfg at inference
+teacher_steps = 32  # teacher euler steps over the whole trajectory, split evenly among student steps
+sway_sampling_coef = -1.0  # of the student's schedule, keep the same for inference
+
 # ----------------------------------------------------------------------- #
 
 
@@ -70,26 +80,46 @@ def main():
         transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
         mel_spec_kwargs=mel_spec_kwargs,
         vocab_char_map=vocab_char_map,
+        native_steps=native_steps if distill_teacher_ckpt else None,
+        distilled_cfg_strength=distill_cfg_strength if distill_teacher_ckpt else None,
     )
 
+    if distill_teacher_ckpt:  # frozen ema teacher, student starts from its weights
+        from f5_tts.infer.utils_infer import load_checkpoint
+
+        teacher = CFM(
+            transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
+            mel_spec_kwargs=mel_spec_kwargs,
+            vocab_char_map=vocab_char_map,
+        )
+        teacher = load_checkpoint(teacher, distill_teacher_ckpt, "cpu", dtype=torch.float32, use_ema=True)
+        model.load_state_dict(teacher.state_dict())
+        distill_kwargs = dict(teacher_steps=teacher_steps, sway_sampling_coef=sway_sampling_coef)
+        run_name = f"{exp_name}_distill{f'_nfe{native_steps}' if native_steps else ''}"
+        run_name += f"_cfg{distill_cfg_strength}" if distill_cfg_strength else ""
+    else:
+        teacher, distill_kwargs, run_name = None, dict(), exp_name
+
     trainer = Trainer(
         model,
         epochs,
         learning_rate,
         num_warmup_updates=num_warmup_updates,
         save_per_updates=save_per_updates,
-        checkpoint_path=str(files("f5_tts").joinpath(f"../../ckpts/{exp_name}")),
+        checkpoint_path=str(files("f5_tts").joinpath(f"../../ckpts/{run_name}")),
         batch_size=batch_size_per_gpu,
         batch_size_type=batch_size_type,
         max_samples=max_samples,
         grad_accumulation_steps=grad_accumulation_steps,
         max_grad_norm=max_grad_norm,
         wandb_project="CFM-TTS",
-        wandb_run_name=exp_name,
+        wandb_run_name=run_name,
         wandb_resume_id=wandb_resume_id,
         last_per_steps=last_per_steps,
         log_samples=True,
         mel_spec_type=mel_spec_type,
+        teacher_model=teacher,
+        distill_kwargs=distill_kwargs,
     )
 
     train_dataset = load_dataset(dataset_name, tokenizer, mel_spec_kwargs=mel_spec_kwargs)
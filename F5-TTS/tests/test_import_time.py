@@ -0,0 +1,41 @@
+import subprocess
+import sys
+import time
+
+
+# importing the inference utilities (as cli, api, gradio and workers do at start) stays cheap: heavy optional
+# libraries are imported inside the functions using them, and the cuda / mps device probe runs on first use
+
+heavy_modules = ["transformers", "vocos", "matplotlib", "huggingface_hub"]
+import_budget_s = 15.0  # wall clock for a fresh interpreter, dominated by torch itself
+
+
+def run_python(code):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=False
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result, time.perf_counter() - start
+
+
+def test_utils_infer_import_is_light():
+    result, elapsed = run_python("import f5_tts.infer.utils_infer")
+
+    imported = {
+        line.split("|")[-1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    assert not imported & set(heavy_modules), f"imported at module scope: {sorted(imported & set(heavy_modules))}"
+    assert elapsed < import_budget_s, f"import took {elapsed:.1f} s, budget {import_budget_s} s"
+
+
+def test_device_probe_is_deferred():
+    run_python(
+        "import torch\n"
+        "def probe():\n"
+        "    raise AssertionError('device probed at import')\n"
+        "torch.cuda.is_available = torch.backends.mps.is_available = probe\n"
+        "import f5_tts.infer.utils_infer"
+    )
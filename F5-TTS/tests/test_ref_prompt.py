@@ -0,0 +1,45 @@
+from importlib.resources import files
+
+import pytest
+import torch
+
+from f5_tts.infer.utils_infer import get_prompt_text_list, get_ref_prompt
+from f5_tts.model import CFM, DiT
+from f5_tts.model.utils import convert_char_to_pinyin, get_tokenizer
+
+
+# the reference is tokenized once per voice, only the generated text per chunk, yet together they have to be the
+# tokens of reference & generated text converted at once, as the model was trained on: jieba segmentation and the
+# spacing of latin words depend on what precedes them
+
+cases = [
+    ("对，这就是我，万人敬仰的太乙真人。", "Some call me nature."),
+    ("对，这就是我，万人敬仰的太乙真人", "Some call me nature."),
+    ("Some call me nature, others call me mother nature.", "对，这就是我。"),
+    ("我喜欢", "吃苹果"),
+    ("今天天气很好", "你好"),
+    ("他说“好”", "okay then"),
+    ("价格是100", "元，not 100 dollars"),
+    ("第一行\r\n第二行", "third line"),
+    ("Hello 世界", "world"),
+    ("a;b", ";c"),
+]
+
+
+@pytest.fixture(scope="module")
+def model():
+    vocab_char_map, vocab_size = get_tokenizer(str(files("f5_tts").joinpath("infer/examples/vocab.txt")), "custom")
+    transformer = DiT(dim=64, depth=1, heads=2, dim_head=32, text_num_embeds=vocab_size, mel_dim=100)
+    return CFM(transformer=transformer, vocab_char_map=vocab_char_map)
+
+
+@pytest.mark.parametrize("ref_text, gen_text", cases)
+def test_prompt_tokens_match_joint_conversion(model, ref_text, gen_text):
+    ref_audio = (torch.randn(1, 24000) * 0.1, 24000)
+    prompt = get_ref_prompt(ref_audio, ref_text, model, device="cpu")
+    (gen_tokens,) = get_prompt_text_list([prompt], [gen_text])
+    tokens = prompt.text_ids.tolist() + model.tokenize([gen_tokens])[0].tolist()
+
+    if len(ref_text[-1].encode("utf-8")) == 1:  # as get_ref_prompt() does
+        ref_text = ref_text + " "
+    assert tokens == model.tokenize(convert_char_to_pinyin([ref_text + gen_text]))[0].tolist()